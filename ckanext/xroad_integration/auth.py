@@ -11,3 +11,8 @@ def xroad_error_list(context, data_dict):
             return {"success": True}
         except NotAuthorized:
             return {"success": False, "msg": _(u"User not authorized to view X-Road error list for organization")}
+
+
+def xroad_error_stats(context, data_dict):
+    # Same access as to the errors the statistics are counted from
+    return xroad_error_list(context, data_dict)
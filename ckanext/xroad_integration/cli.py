@@ -3,6 +3,7 @@
 import json
 import jinja2
 from ckan.lib import mailer
+from ckanext.xroad_integration.harvesters.xroad_blob_store import get_blob_store
 from ckanext.xroad_integration.harvesters.xroad_types import Subsystem
 
 from datetime import datetime
@@ -10,7 +11,8 @@ from datetime import datetime
 import click
 
 import ckan.model as model
-from ckanext.xroad_integration.model import init_table, drop_table
+from ckanext.xroad_integration.model import init_table, drop_table, XRoadError, XRoadErrorRollup
+from ckanext.xroad_integration.xroad_error_categories import get_error_categories
 
 from ckan.plugins import toolkit
 get_action = toolkit.get_action
@@ -74,18 +76,23 @@ def drop_db(yes_i_am_sure):
 
 @xroad.command()
 @click.pass_context
-def update_xroad_organizations(ctx):
+@click.option(u'--full', is_flag=True, help="Updates all organizations regardless of reported changes")
+def update_xroad_organizations(ctx, full):
     'Updates harvested organizations\' metadata'
     flask_app = ctx.meta["flask_app"]
     with flask_app.test_request_context():
         try:
             toolkit.g.user = _admin_user()['name']
             context = {'ignore_auth': True, 'user': toolkit.g.user}
-            result = get_action('update_xroad_organizations')(context, {})
+            result = get_action('update_xroad_organizations')(context, {'full': full})
         except Exception as e:
             result = {'success': False, 'message': 'Exception: {}'.format(e)}
 
         success = result.get('success') is True
+        if result.get('sources'):
+            click.secho('Applied to sources: %s' % ', '.join(result['sources']))
+        click.secho(result.get('message', ''), fg='green' if success else 'red')
+
         get_action('xroad_batch_result_create')({'ignore_auth': True}, {'service': 'update_xroad_organizations',
                                                                         'success': success,
                                                                         'message': result.get('message')})
@@ -256,6 +263,38 @@ def fetch_heartbeat(ctx):
             click.secho('Error fetching heartbeat: \n %s' % e, fg='red')
 
 
+@xroad.command()
+@click.option(u'--days', type=int, default=7, show_default=True,
+              help=u'Remove service descriptions not stored by harvests during this many days')
+def purge_blobs(days):
+    'Removes stale service descriptions from the harvester blob store'
+    blob_store = get_blob_store()
+    if blob_store is None:
+        click.secho('Blob store is not configured', fg='yellow')
+        return
+
+    removed = blob_store.purge(days * 24 * 60 * 60)
+    click.secho('Removed %d service descriptions from %s' % (removed, blob_store.directory), fg='green')
+
+
+@xroad.command()
+def categorize_errors():
+    'Updates categories of stored errors to match the configured error categories'
+    changed = XRoadError.recategorize(get_error_categories())
+    click.secho('Updated category of %d errors' % changed, fg='green')
+
+
+@xroad.command()
+@click.option(u'-s', u'--start-date', type=click.DateTime(formats=["%Y-%m-%d"]),
+              help="""Optional. First day to recount, all days are recounted by default""",)
+@click.option(u'-e', u'--end-date', type=click.DateTime(formats=["%Y-%m-%d"]),
+              help="""Optional. Last day to recount""",)
+def rebuild_error_stats(start_date, end_date):
+    'Recounts daily error statistics from stored errors'
+    XRoadErrorRollup.rebuild(start_date.date() if start_date else None, end_date.date() if end_date else None)
+    click.secho('Error statistics rebuilt', fg='green')
+
+
 @xroad.command()
 def latest_batch_run_results():
     results = get_latest_batch_run_results()
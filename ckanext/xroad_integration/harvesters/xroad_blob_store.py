@@ -0,0 +1,192 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import time
+from typing import BinaryIO, Optional
+
+from ckan.plugins import toolkit
+
+log = logging.getLogger(__name__)
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+class BlobStore(object):
+    '''Content-addressed store of fetched service descriptions on local disk
+
+    Blobs are stored once per distinct content and referenced by the SHA-256 digest of their UTF-8 encoding.
+    Storing an existing blob again refreshes its modification time, which `purge` uses to find unused blobs.
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        if len(digest) != 64 or not all(c in '0123456789abcdef' for c in digest):
+            raise BlobNotFound(digest)
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def put(self, data: str) -> str:
+        encoded = data.encode('utf-8')
+        digest = hashlib.sha256(encoded).hexdigest()
+        path = self.path(digest)
+
+        if os.path.exists(path):
+            os.utime(path)
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encoded)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return digest
+
+    def touch(self, digest: str) -> bool:
+        '''Refreshes the modification time of a stored blob, returns whether the blob is stored'''
+        try:
+            os.utime(self.path(digest))
+            return True
+        except (BlobNotFound, FileNotFoundError):
+            return False
+
+    def get(self, digest: str) -> str:
+        try:
+            with open(self.path(digest), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BlobNotFound(digest)
+
+    def open(self, digest: str) -> BinaryIO:
+        '''Opens the UTF-8 encoded blob for reading, the caller closes the file'''
+        try:
+            return open(self.path(digest), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFound(digest)
+
+    def open_lazy(self, digest: str, size: int) -> 'LazyBlobFile':
+        '''Returns a file of the blob that holds no file handle until read, the caller closes the file'''
+        path = self.path(digest)
+        if not os.path.isfile(path):
+            raise BlobNotFound(digest)
+        return LazyBlobFile(path, size)
+
+    def purge(self, max_age: float) -> int:
+        '''Removes blobs not stored during the last `max_age` seconds, returns the number of removed blobs'''
+        threshold = time.time() - max_age
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime < threshold:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class LazyBlobFile(object):
+    '''Read-only file of a stored blob, opened on first read and closed again once read to the end
+
+    Uploads of all resources of a package are prepared before any of them is stored, so each upload holds a
+    file handle only while it is being read.
+    '''
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.closed = False
+        self._file: Optional[BinaryIO] = None
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+            self._file.seek(self._position)
+
+        data = self._file.read(size)
+        self._position = self._file.tell()
+        if not data or size is None or size < 0:
+            self._release()
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if self._file is not None:
+            self._file.seek(offset)
+        self._position = offset
+        return offset
+
+    def tell(self) -> int:
+        return self._position
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def _release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self._release()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_blob_store: Optional[BlobStore] = None
+_blob_store_loaded = False
+
+
+def get_blob_store() -> Optional[BlobStore]:
+    '''Returns the blob store of this process, or None if no storage location is available
+
+    Blobs are stored in `ckanext.xroad_integration.blob_storage_path`, by default under `ckan.storage_path`.
+    Without a blob store fetched service descriptions are kept inline in the harvest object.
+    '''
+    global _blob_store, _blob_store_loaded
+    if _blob_store_loaded:
+        return _blob_store
+
+    _blob_store_loaded = True
+    directory = toolkit.config.get('ckanext.xroad_integration.blob_storage_path')
+    if not directory:
+        storage_path = toolkit.config.get('ckan.storage_path')
+        directory = os.path.join(storage_path, 'xroad_blobs') if storage_path else None
+
+    if not directory:
+        log.info('Blob store is disabled, service descriptions are stored in harvest objects')
+        return None
+
+    try:
+        _blob_store = BlobStore(directory)
+    except OSError as e:
+        log.warning('Blob store is disabled, could not create %s: %s', directory, e)
+
+    return _blob_store
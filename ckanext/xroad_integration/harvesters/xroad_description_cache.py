@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from typing import Optional, Tuple
+
+from ckan.plugins import toolkit
+
+from .xroad_blob_store import BlobStore, get_blob_store
+from .xroad_types import ServiceDescription
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_ENTRIES = 100000
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024  # bytes
+
+# A full cache is evicted below its limits by this factor, so entries are not scanned again on every put
+EVICTION_TARGET = 0.9
+
+
+class ServiceDescriptionCache(object):
+    '''On-disk index of fetched WSDL and OpenAPI documents kept in the blob store
+
+    Entries map the kind of a description and its `external_id` and `changed` timestamp to the digest of the
+    document in the blob store, so a document is only served as long as the catalog reports no newer change
+    for it. The documents themselves are stored once, in the blob store. The number of entries and the total
+    size of the documents they reference are bounded, least recently used entries are evicted first.
+    '''
+
+    def __init__(self, directory: str, blob_store: BlobStore, max_entries: int, max_size: int):
+        self.directory = directory
+        self.blob_store = blob_store
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._entries: Optional[int] = None
+        self._size: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind: str, description: ServiceDescription) -> Optional[str]:
+        if not description.external_id or not description.changed:
+            return None
+        key = '\n'.join([kind, description.external_id, description.changed.isoformat()])
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get(self, kind: str, description: ServiceDescription) -> Optional[str]:
+        '''Returns the blob store digest of the document, or None if it is not cached or no longer stored'''
+        path = self._path(kind, description)
+        if path is None:
+            return None
+
+        try:
+            digest, _ = self._read_entry(path)
+            self._touch(path)
+        except OSError:
+            return None
+
+        # Blobs in use are refreshed so they are not purged from the blob store
+        if not self.blob_store.touch(digest):
+            return None
+
+        return digest
+
+    def put(self, kind: str, description: ServiceDescription, digest: str):
+        path = self._path(kind, description)
+        if path is None:
+            return
+
+        temp_path = None
+        try:
+            size = os.path.getsize(self.blob_store.path(digest))
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(f'{digest}\n{size}')
+            os.replace(temp_path, path)
+            self._touch(path)
+        except OSError as e:
+            log.warning('Could not store service description in cache: %s', e)
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        if self._entries is not None:
+            self._entries += 1
+            self._size += size
+        if self._entries is None or self._entries > self.max_entries or self._size > self.max_size:
+            self._evict(keep=path)
+
+    @staticmethod
+    def _read_entry(path: str) -> Tuple[str, int]:
+        # Entries contain the digest and the size of the document
+        with open(path, 'r', encoding='utf-8') as f:
+            digest, _, size = f.read().partition('\n')
+        return digest, int(size) if size.isdigit() else 0
+
+    @staticmethod
+    def _touch(path: str):
+        # Modification time tracks last use for eviction
+        now = time.time()
+        os.utime(path, (now, now))
+
+    def _evict(self, keep: str):
+        '''Recounts the entries and, if the cache is over its limits, evicts entries down to EVICTION_TARGET'''
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.tmp-'):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+                _, size = self._read_entry(entry.path)
+            except OSError:
+                continue
+            entries.append((mtime, entry.path, size))
+
+        count = len(entries)
+        total_size = sum(size for _, _, size in entries)
+        if count > self.max_entries or total_size > self.max_size:
+            target_entries = int(self.max_entries * EVICTION_TARGET)
+            target_size = int(self.max_size * EVICTION_TARGET)
+            for _, path, size in sorted(entries):
+                if count <= target_entries and total_size <= target_size:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    count -= 1
+                    total_size -= size
+                except OSError:
+                    pass
+
+        self._entries = count
+        self._size = total_size
+
+
+_cache: Optional[ServiceDescriptionCache] = None
+_cache_loaded = False
+
+
+def get_description_cache() -> Optional[ServiceDescriptionCache]:
+    '''Returns the service description cache of this process, or None if caching is disabled
+
+    The cache is stored in `ckanext.xroad_integration.service_description_cache_dir`, by default under
+    `ckan.storage_path`. Its number of entries is limited by
+    `ckanext.xroad_integration.service_description_cache_entries` and the total size of the cached documents
+    in bytes by `ckanext.xroad_integration.service_description_cache_size`, 0 in either disables the cache.
+    The cache is also disabled without a blob store.
+    '''
+    global _cache, _cache_loaded
+    if _cache_loaded:
+        return _cache
+
+    _cache_loaded = True
+    max_entries = toolkit.asint(toolkit.config.get('ckanext.xroad_integration.service_description_cache_entries',
+                                                   DEFAULT_CACHE_ENTRIES))
+    max_size = toolkit.asint(toolkit.config.get('ckanext.xroad_integration.service_description_cache_size',
+                                                DEFAULT_CACHE_SIZE))
+    directory = toolkit.config.get('ckanext.xroad_integration.service_description_cache_dir')
+    if not directory:
+        storage_path = toolkit.config.get('ckan.storage_path')
+        directory = os.path.join(storage_path, 'xroad_service_descriptions') if storage_path else None
+
+    blob_store = get_blob_store()
+    if max_entries <= 0 or max_size <= 0 or not directory or blob_store is None:
+        log.info('Service description cache is disabled')
+        return None
+
+    try:
+        _cache = ServiceDescriptionCache(directory, blob_store, max_entries, max_size)
+    except OSError as e:
+        log.warning('Service description cache is disabled, could not create %s: %s', directory, e)
+
+    return _cache
@@ -0,0 +1,95 @@
+import json
+import logging
+from typing import Dict, Any, Callable, List
+
+from sqlalchemy import event as sa_event, inspect as sa_inspect
+
+from ckan import model
+from ckan.plugins import toolkit
+from ckanext.harvest.model import HarvestJob
+
+log = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_SPOOL_SIZE = 4 * 1024 * 1024  # bytes
+
+
+class HarvestRunContext(object):
+    '''Values that are fixed for the duration of a harvest job
+
+    A context is created once per job in each worker process and shared by the gather, fetch and import
+    stages run in that process. Values that are expensive to compute are stored with `cached` on first use.
+    '''
+
+    def __init__(self, harvest_job):
+        self.job_id = harvest_job.id
+        self.source_id = harvest_job.source_id
+        config_str = harvest_job.source.config
+        self.config = json.loads(config_str) if config_str else {}
+        self.unknown_service_link_url = toolkit.config.get('ckanext.xroad_integration.unknown_service_link_url')
+        # Uploads larger than this are spooled to disk instead of memory
+        self.upload_spool_size = toolkit.asint(toolkit.config.get('ckanext.xroad_integration.upload_spool_size',
+                                                                  DEFAULT_UPLOAD_SPOOL_SIZE))
+        self._values: Dict[str, Any] = {}
+
+    def cached(self, key: str, compute: Callable[[], Any]) -> Any:
+        if key not in self._values:
+            self._values[key] = compute()
+        return self._values[key]
+
+    def discard(self, key: str):
+        self._values.pop(key, None)
+
+
+_run_contexts: Dict[str, HarvestRunContext] = {}
+
+
+def get_run_context(harvest_job) -> HarvestRunContext:
+    '''Returns the run context of the job, creating it on first use in this process'''
+    run_context = _run_contexts.get(harvest_job.id)
+
+    if run_context is None:
+        # Only one job runs per source at a time, so contexts of earlier jobs of the source are stale.
+        # Jobs finished by another process are dropped here, as this process did not see them finish.
+        stale_job_ids = [job_id for job_id, c in _run_contexts.items() if c.source_id == harvest_job.source_id]
+        stale_job_ids.extend(_finished_job_ids([job_id for job_id in _run_contexts if job_id not in stale_job_ids]))
+        for job_id in stale_job_ids:
+            invalidate_run_context(job_id)
+
+        log.debug('Creating harvest run context for job %s', harvest_job.id)
+        run_context = _run_contexts[harvest_job.id] = HarvestRunContext(harvest_job)
+
+        # Listening starts with the first job run in this process. Listeners cannot be removed while a flush
+        # dispatches them, so once all contexts are dropped the listener is left in place and returns at once.
+        if not sa_event.contains(model.Session, 'before_flush', _finish_jobs):
+            sa_event.listen(model.Session, 'before_flush', _finish_jobs)
+
+    return run_context
+
+
+def _finished_job_ids(job_ids: List[str]) -> List[str]:
+    if not job_ids:
+        return []
+    query = model.Session.query(HarvestJob.id).filter(HarvestJob.id.in_(job_ids), HarvestJob.status == 'Finished')
+    return [job_id for job_id, in query]
+
+
+def invalidate_run_context(job_id: str):
+    '''Drops the run context of a job, called when the job is marked as finished'''
+    if _run_contexts.pop(job_id, None) is not None:
+        log.debug('Invalidated harvest run context for job %s', job_id)
+
+
+def _finish_jobs(session, flush_context, instances):
+    '''Drops the run contexts of jobs that are being marked as finished
+
+    Jobs are finished by `harvest_jobs_run` after their last object, or when they are aborted or time out.
+    Only jobs with a run context in this process are considered, so no relationships of jobs are loaded.
+    '''
+    if not _run_contexts:
+        return
+
+    finished_job_ids = [job.id for job in session.dirty
+                        if isinstance(job, HarvestJob) and job.id in _run_contexts and job.status == 'Finished'
+                        and sa_inspect(job).attrs.status.history.has_changes()]
+    for job_id in finished_job_ids:
+        invalidate_run_context(job_id)
@@ -1,31 +1,43 @@
-import os
-import tempfile
+import copy
+import hashlib
 import logging
 import json
 import requests
 import lxml.etree as etree
 import six
 import iso8601
-from typing import Optional, Dict, Any
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import BinaryIO, Optional, Dict, Any, Iterator, Union, List, Tuple
 
-from sqlalchemy import text, exists
+from sqlalchemy import text, exists, inspect as sa_inspect
 from datetime import datetime, timedelta
-from requests.exceptions import ConnectionError
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import HTTPError as Urllib3HTTPError
 
 from ckanext.harvest.harvesters import HarvesterBase
-from ckanext.harvest.model import HarvestJob, HarvestObject, HarvestGatherError
+from ckanext.harvest.model import HarvestJob, HarvestObject, HarvestObjectExtra, HarvestGatherError
 import ckan.plugins as p
+from ckan.lib.navl.validators import ignore, ignore_missing
 from ckan.lib.search.common import SearchIndexError
 
 from ckan.lib.munge import munge_title_to_name, substitute_ascii_equivalents
 from ckan import model
 from ckan import logic
+from ckan.model.types import make_uuid
+from ckan.logic.schema import default_create_package_schema
+from ckan.logic.validators import unicode_safe
 
 from werkzeug.datastructures import FileStorage as FlaskFileStorage
 
-from .xroad_types import MemberList, Subsystem, RestServices, Service
+from .xroad_blob_store import get_blob_store, BlobNotFound
+from .xroad_description_cache import get_description_cache
+from .xroad_harvest_context import HarvestRunContext, get_run_context
+from .xroad_organizations import OrganizationIndex
+from .xroad_types_utils import CODECS
+from .xroad_types import Member, Error, Subsystem, RestServices, Service, iter_member_list
+from ckanext.xroad_integration.model import XRoadHarvestFingerprint
+from ckanext.xroad_integration.xroad_http import get_session, TRANSPORT_ERRORS
 from ckanext.xroad_integration.xroad_utils import xroad_catalog_query_json, ContentFetchError
 
 try:
@@ -38,41 +50,34 @@ NotFound = logic.NotFound
 
 log = logging.getLogger(__name__)
 
-DEFAULT_TIMEOUT = 3  # seconds
-
-
-# Add default timeout
-class TimeoutHTTPAdapter(HTTPAdapter):
-    def __init__(self, *args, **kwargs):
-        self.timeout = DEFAULT_TIMEOUT
-        if 'timeout' in kwargs:
-            self.timeout = kwargs['timeout']
-            del kwargs['timeout']
-        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+DEFAULT_HARVEST_OBJECT_BATCH_SIZE = 500
+DEFAULT_FETCH_CONCURRENCY = 4
 
-
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=1
-)
-
-adapter = TimeoutHTTPAdapter(max_retries=retry_strategy)
-http = requests.Session()
-http.mount('http://', adapter)
+WSDL_ROOT_TAGS = ('{http://schemas.xmlsoap.org/wsdl/}definitions', '{http://www.w3.org/ns/wsdl}description')
+SOAP_FAULT_TAG = '{http://schemas.xmlsoap.org/soap/envelope/}Fault'
+WSDL_MAX_DEPTH = 256
+WSDL_MAX_SCAN_BYTES = 16 * 1024 * 1024
+WSDL_SCAN_CHUNK_SIZE = 64 * 1024
 
 
 class XRoadHarvesterPlugin(HarvesterBase):
     config = {}
+    run_context = None
 
-    def _set_config(self, config_str):
-        if config_str:
-            self.config = json.loads(config_str)
-            if 'api_version' in self.config:
-                self.api_version = int(self.config['api_version'])
+    def _load_run_context(self, harvest_job) -> HarvestRunContext:
+        self.run_context = get_run_context(harvest_job)
+        self.config = self.run_context.config
+        if 'api_version' in self.config:
+            self.api_version = int(self.config['api_version'])
 
-            log.debug('Using config: %r', self.config)
-        else:
-            self.config = {}
+        log.debug('Using config: %r', self.config)
+        return self.run_context
+
+    def _user_name(self) -> str:
+        return self.run_context.cached('user_name', self._get_user_name)
+
+    def _job_last_error_free_job_time(self, harvest_job) -> Optional[str]:
+        return self.run_context.cached('last_error_free_job_time', lambda: self._last_error_free_job_time(harvest_job))
 
     def info(self):
 
@@ -80,7 +85,8 @@ class XRoadHarvesterPlugin(HarvesterBase):
             'name': 'xroad',
             'title': 'X-Road Rest Gateway',
             'description': 'Server that provides Rest Gateway for X-Road. '
-                           'Valid config keys: force_all, force_organization_update, force_resource_update, since'
+                           'Valid config keys: force_all, force_organization_update, force_resource_update, since, '
+                           'harvest_object_batch_size, fetch_concurrency, serialization_codec'
         }
 
     def validate_config(self, config):
@@ -99,92 +105,121 @@ class XRoadHarvesterPlugin(HarvesterBase):
             except ValueError:
                 raise ValueError(f'{since} must be in format YYYY-MM-DD')
 
+        for key in ('harvest_object_batch_size', 'fetch_concurrency'):
+            value = config_obj.get(key)
+            if value is not None:
+                if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                    raise ValueError(f'{key} must be a positive integer')
+
+        codec = config_obj.get('serialization_codec')
+        if codec is not None and codec not in CODECS:
+            raise ValueError(f'serialization_codec must be one of: {", ".join(CODECS)}')
+
         return config
 
     def gather_stage(self, harvest_job):
         log.debug('In xroad harvester gather_stage')
 
-        self._set_config(harvest_job.source.config)
+        run_context = self._load_run_context(harvest_job)
 
         if self.config.get('force_all', False) is True:
             last_time = '2011-01-01'
         elif self.config.get('since'):
             last_time = str(self.config.get('since'))
         else:
-            last_time = self._last_error_free_job_time(harvest_job) or '2011-01-01'
-
-        try:
-            catalog = self._get_xroad_catalog(harvest_job.source.url, last_time)
-
-            member_list = MemberList.from_dict(catalog)
-            if member_list.error:
-                self._save_gather_error('There was an error on xroad catalog %r' % member_list.error, harvest_job)
-                return False
-        except ContentFetchError as e:
-            self._save_gather_error('%r' % e.args, harvest_job)
-            return False
-        except KeyError as e:
-            self._save_gather_error('Failed to parse response: %r' % e, harvest_job)
-            return False
-        except ValueError as e:
-            self._save_gather_error('Failed to parse response: %r' % e, harvest_job)
-            return False
+            last_time = self._job_last_error_free_job_time(harvest_job) or '2011-01-01'
 
         # Member = organization
         # Subsystem = package = API
         # Service = resource = WSDL
 
-        object_ids = []
-        for member in member_list.members:
-            # TODO: X-Road Catalog IsProvider is not in use for now, restore by utilizing _get_member_type
-
-            # If X-Road catalog is not used, following sets member_type to provider
-            # if subsystem has at least one active service
-            if all(service.removed for subsystem in member.subsystems for service in subsystem.services):
-                member.member_type = 'consumer'
-            else:
-                member.member_type = 'provider'
+        batch_size = self.config.get('harvest_object_batch_size', DEFAULT_HARVEST_OBJECT_BATCH_SIZE)
+        harvest_objects = HarvestObjectBatch(harvest_job, batch_size)
 
-            # Create organization id
-            org_id = substitute_ascii_equivalents(f'{member.instance}.{member.member_class}.{member.member_code}')
+        try:
+            for member in self._get_xroad_catalog(harvest_job.source.url, last_time):
+                if isinstance(member, Error):
+                    return self._gather_failed('There was an error on xroad catalog %r' % member, harvest_job,
+                                               harvest_objects)
 
-            try:
-                org = self._create_or_update_organization(org_id, member, harvest_job)
-            except p.toolkit.ValidationError as e:
-                log.warning(f'Validation error creating/updating organization {org_id}: {e}')
-                self._save_gather_error(f'Validation error creating/updating organization {org_id}: {e}', harvest_job)
-                continue
-            except SearchIndexError as e:
-                log.warning(f'Indexing error creating/updating organization {org_id}: {e}')
-                self._save_gather_error(f'Indexing error creating/updating organization {org_id}: {e}', harvest_job)
-                continue
+                self._gather_member(member, harvest_job, harvest_objects)
+        except ContentFetchError as e:
+            return self._gather_failed('%r' % e.args, harvest_job, harvest_objects)
+        except KeyError as e:
+            return self._gather_failed('Failed to parse response: %r' % e, harvest_job, harvest_objects)
+        except ValueError as e:
+            return self._gather_failed('Failed to parse response: %r' % e, harvest_job, harvest_objects)
+        finally:
+            # The organization index and fingerprints are only needed during gather
+            run_context.discard('organization_index')
+            run_context.discard('fingerprints')
+
+        harvest_objects.flush()
+        return harvest_objects.object_ids
+
+    def _gather_failed(self, message, harvest_job, harvest_objects):
+        # Members are processed while ListMembers is still being read, so objects may already exist for members
+        # preceding the failure. Those are still fetched, and the gather error keeps this job from being used
+        # as the starting point of the next incremental harvest.
+        harvest_objects.flush()
+        self._save_gather_error(message, harvest_job)
+        return harvest_objects.object_ids if harvest_objects.object_ids else False
+
+    def _gather_member(self, member, harvest_job, harvest_objects):
+        # TODO: X-Road Catalog IsProvider is not in use for now, restore by utilizing _get_member_type
+
+        # If X-Road catalog is not used, following sets member_type to provider
+        # if subsystem has at least one active service
+        if all(service.removed for subsystem in member.subsystems for service in subsystem.services):
+            member.member_type = 'consumer'
+        else:
+            member.member_type = 'provider'
 
-            if org is None or member.removed:
-                # Organization has been removed
-                continue
+        # Create organization id
+        org_id = substitute_ascii_equivalents(f'{member.instance}.{member.member_class}.{member.member_code}')
 
-            for subsystem in member.subsystems:
-                # Generate GUID
-                guid = substitute_ascii_equivalents(f'{org_id}.{subsystem.subsystem_code}')
+        try:
+            org = self._create_or_update_organization(org_id, member, harvest_job)
+        except p.toolkit.ValidationError as e:
+            log.warning(f'Validation error creating/updating organization {org_id}: {e}')
+            self._save_gather_error(f'Validation error creating/updating organization {org_id}: {e}', harvest_job)
+            return
+        except SearchIndexError as e:
+            log.warning(f'Indexing error creating/updating organization {org_id}: {e}')
+            self._save_gather_error(f'Indexing error creating/updating organization {org_id}: {e}', harvest_job)
+            return
+
+        if org is None or member.removed:
+            # Organization has been removed
+            return
+
+        if self.config.get('force_all') is True or self.config.get('force_resource_update') is True:
+            fingerprints = {}
+        else:
+            fingerprints = self.run_context.cached('fingerprints', XRoadHarvestFingerprint.get_active)
 
-                # Create harvest object
-                obj = HarvestObject(guid=guid, job=harvest_job,
-                                    content=json.dumps({
-                                        'xRoadInstance': member.instance,
-                                        'xRoadMemberClass': member.member_class,
-                                        'xRoadMemberCode': member.member_code,
-                                        'owner_name': org.get('name'),
-                                        'subsystem_pickled': subsystem.serialize(),
-                                    }))
+        for subsystem in member.subsystems:
+            # Generate GUID
+            guid = substitute_ascii_equivalents(f'{org_id}.{subsystem.subsystem_code}')
 
-                obj.save()
-                object_ids.append(obj.id)
+            fingerprint = subsystem.fingerprint(member.instance, member.member_class, member.member_code, org.get('name'))
+            if fingerprints.get(guid) == fingerprint:
+                log.debug(f'Subsystem {guid} has not changed since it was last imported, skipping...')
+                continue
 
-        return object_ids
+            # Create harvest object
+            harvest_objects.add(guid, json.dumps({
+                'xRoadInstance': member.instance,
+                'xRoadMemberClass': member.member_class,
+                'xRoadMemberCode': member.member_code,
+                'owner_name': org.get('name'),
+                'fingerprint': fingerprint,
+                'subsystem_pickled': subsystem.serialize(self.config.get('serialization_codec')),
+            }))
 
     def fetch_stage(self, harvest_object):
         log.info('In xroad harvester fetch_stage')
-        self._set_config(harvest_object.job.source.config)
+        self._load_run_context(harvest_object.job)
 
         try:
             dataset = json.loads(harvest_object.content)
@@ -197,46 +232,16 @@ class XRoadHarvesterPlugin(HarvesterBase):
 
         try:
             if subsystem.services:
-                for service in subsystem.services:
-                    if service.removed:
-                        log.info(f'Service {service.service_code} has been removed, '
-                                 'no need to fetch api descriptions or types, skipping...')
-                        continue
+                cache_hits, cache_misses = self._fetch_service_descriptions(harvest_object, dataset, subsystem)
+                self._store_service_descriptions(subsystem)
+
+                if cache_hits or cache_misses:
+                    HarvestObjectExtra(harvest_object_id=harvest_object.id, key='description_cache_hits',
+                                       value=str(cache_hits)).save()
+                    HarvestObjectExtra(harvest_object_id=harvest_object.id, key='description_cache_misses',
+                                       value=str(cache_misses)).save()
 
-                    if service.wsdl:
-                        wsdl_data = self._get_wsdl(harvest_object.source.url, service.wsdl.external_id)
-                        if wsdl_data:
-                            service.wsdl.data = wsdl_data
-                        else:
-                            log.warn(f'Empty WSDL service description returned for {generate_service_name(service)}')
-
-                    if service.openapi:
-                        openapi_data = self._get_openapi(harvest_object.source.url, service.openapi.external_id)
-                        if openapi_data:
-                            service.openapi.data = openapi_data
-                        else:
-                            log.warn(f'Empty OpenApi service description returned for {generate_service_name(service)}')
-
-                    if service.service_type.lower() == 'rest':
-                        try:
-                            path = '/'.join(['getRest',
-                                             dataset['xRoadInstance'],
-                                             dataset['xRoadMemberClass'],
-                                             dataset['xRoadMemberCode'],
-                                             subsystem.subsystem_code,
-                                             service.service_code])
-                            rest_services_data = xroad_catalog_query_json(path)
-                            service.rest_services = RestServices.from_dict(rest_services_data)
-                        except ContentFetchError:
-                            error = f'Could not retrieve REST services {harvest_object.id}'
-                            log.info(error, harvest_object, 'Fetch')
-                            self._save_object_error(error, harvest_object, 'Fetch')
-                        except ValueError:
-                            error = f'Error parsing REST services {harvest_object.id}'
-                            log.info(error, harvest_object, 'Fetch')
-                            self._save_object_error(error, harvest_object, 'Fetch')
-
-                dataset['subsystem_pickled'] = subsystem.serialize()
+                dataset['subsystem_pickled'] = subsystem.serialize(self.config.get('serialization_codec'))
                 dataset['subsystem_dict'] = json.loads(subsystem.serialize_json())
 
                 def truncate(obj, field, max_length=1024):
@@ -245,8 +250,9 @@ class XRoadHarvesterPlugin(HarvesterBase):
                         obj[field] = data[:max_length] + ' (truncated)'
 
                 for service in dataset['subsystem_dict'].get('services', []):
-                    truncate(service, 'wsdl')
-                    truncate(service, 'openapi')
+                    for description in (service.get('wsdl'), service.get('openapi')):
+                        if description:
+                            truncate(description, 'data')
 
                 harvest_object.content = json.dumps(dataset)
                 harvest_object.save()
@@ -256,9 +262,148 @@ class XRoadHarvesterPlugin(HarvesterBase):
 
         return True
 
+    def _fetch_service_descriptions(self, harvest_object, dataset, subsystem) -> Tuple[int, int]:
+        '''Fetches service descriptions and REST service lists of the subsystem using a bounded pool of workers.
+
+        Results are merged into the subsystem in service order once fetched. Workers only do HTTP requests,
+        errors are recorded on the harvest object here. Service descriptions found in the description cache
+        for their current `changed` timestamp are not fetched again, they reference the cached blob instead.
+        Returns the number of description cache hits and misses.
+        '''
+        source_url = harvest_object.source.url
+        cache = get_description_cache()
+        cache_stats = self.run_context.cached('description_cache_stats', lambda: {'hits': 0, 'misses': 0})
+        cache_hits, cache_misses = 0, 0
+        fetches = []
+        for service in subsystem.services:
+            if service.removed:
+                log.info(f'Service {service.service_code} has been removed, '
+                         'no need to fetch api descriptions or types, skipping...')
+                continue
+
+            for kind, description, get in (('wsdl', service.wsdl, self._get_wsdl),
+                                           ('openapi', service.openapi, self._get_openapi)):
+                if not description:
+                    continue
+
+                digest = cache.get(kind, description) if cache else None
+                if digest:
+                    description.data_ref = digest
+                    description.data = None
+                    cache_hits += 1
+                else:
+                    fetches.append((service, kind, partial(get, source_url, description.external_id)))
+                    if cache:
+                        cache_misses += 1
+
+            if service.service_type.lower() == 'rest':
+                path = '/'.join(['getRest',
+                                 dataset['xRoadInstance'],
+                                 dataset['xRoadMemberClass'],
+                                 dataset['xRoadMemberCode'],
+                                 subsystem.subsystem_code,
+                                 service.service_code])
+                fetches.append((service, 'rest', partial(xroad_catalog_query_json, path)))
+
+        max_workers = self.config.get('fetch_concurrency', DEFAULT_FETCH_CONCURRENCY)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fetch) for _, _, fetch in fetches]
+            try:
+                for (service, kind, _), future in zip(fetches, futures):
+                    self._merge_fetch_result(harvest_object, service, kind, future)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        if cache_hits or cache_misses:
+            cache_stats['hits'] += cache_hits
+            cache_stats['misses'] += cache_misses
+            log.info('Service description cache for job %s: %d hits, %d misses',
+                     self.run_context.job_id, cache_stats['hits'], cache_stats['misses'])
+
+        return cache_hits, cache_misses
+
+    def _merge_fetch_result(self, harvest_object, service, kind, future):
+        if kind == 'wsdl':
+            wsdl_data = future.result()
+            if wsdl_data:
+                service.wsdl.data = wsdl_data
+            else:
+                log.warn(f'Empty WSDL service description returned for {generate_service_name(service)}')
+
+        elif kind == 'openapi':
+            openapi_data = future.result()
+            if openapi_data:
+                service.openapi.data = openapi_data
+            else:
+                log.warn(f'Empty OpenApi service description returned for {generate_service_name(service)}')
+
+        elif kind == 'rest':
+            try:
+                service.rest_services = RestServices.from_dict(future.result())
+            except ContentFetchError:
+                error = f'Could not retrieve REST services {harvest_object.id}'
+                log.info(error, harvest_object, 'Fetch')
+                self._save_object_error(error, harvest_object, 'Fetch')
+            except ValueError:
+                error = f'Error parsing REST services {harvest_object.id}'
+                log.info(error, harvest_object, 'Fetch')
+                self._save_object_error(error, harvest_object, 'Fetch')
+
+    @staticmethod
+    def _store_service_descriptions(subsystem):
+        '''Moves fetched service descriptions to the blob store, leaving only their digests in the subsystem
+
+        Stored descriptions are added to the description cache, so they are not fetched again until changed.
+        '''
+        blob_store = get_blob_store()
+        if not blob_store:
+            return
+
+        cache = get_description_cache()
+        for service in subsystem.services:
+            for kind, description in (('wsdl', service.wsdl), ('openapi', service.openapi)):
+                if description and description.data is not None:
+                    try:
+                        description.data_ref = blob_store.put(description.data)
+                        description.data = None
+                    except OSError as e:
+                        log.warning('Could not store service description in blob store, keeping it inline: %s', e)
+                        continue
+
+                    if cache:
+                        cache.put(kind, description, description.data_ref)
+
+    @staticmethod
+    def _load_service_description(description) -> Optional[str]:
+        if description.data is None and description.data_ref is not None:
+            blob_store = get_blob_store()
+            if blob_store is None:
+                raise BlobNotFound(description.data_ref)
+            return blob_store.get(description.data_ref)
+        return description.data
+
+    def _open_upload(self, description, data_utf8: bytes) -> BinaryIO:
+        '''Opens the stored blob of a fetched description for upload, other content is spooled to a file
+
+        Blobs are opened lazily, so pending uploads of a package do not each hold a file handle.
+        '''
+        blob_store = get_blob_store()
+        if description is not None and description.data_ref is not None and blob_store is not None:
+            try:
+                return blob_store.open_lazy(description.data_ref, len(data_utf8))
+            except BlobNotFound:
+                pass
+
+        upload_file = tempfile.SpooledTemporaryFile(max_size=self.run_context.upload_spool_size)
+        upload_file.write(data_utf8)
+        upload_file.seek(0)
+        return upload_file
+
     def import_stage(self, harvest_object):
         log.info('In xroad harvester import stage')
-        self._set_config(harvest_object.job.source.config)
+        run_context = self._load_run_context(harvest_object.job)
 
         try:
             dataset = json.loads(harvest_object.content)
@@ -266,10 +411,19 @@ class XRoadHarvesterPlugin(HarvesterBase):
         except ValueError:
             log.info(f'Could not parse content for object {harvest_object.id}', harvest_object, 'Import')
             self._save_object_error(f'Could not parse content for object {harvest_object.id}', harvest_object, 'Import')
-            return False
+            result = False
+        else:
+            result = self._import_subsystem(harvest_object, dataset, subsystem, run_context)
+
+            # Subsystems are only skipped at gather if they were imported without any errors
+            if result in (True, 'unchanged') and dataset.get('fingerprint') and not harvest_object.errors:
+                XRoadHarvestFingerprint.save(harvest_object.guid, dataset['fingerprint'])
 
+        return result
+
+    def _import_subsystem(self, harvest_object, dataset, subsystem, run_context):
         context = {
-            'user': self._get_user_name(),
+            'user': self._user_name(),
             'return_id_only': True,
             'ignore_auth': True,
         }
@@ -287,23 +441,17 @@ class XRoadHarvesterPlugin(HarvesterBase):
         # exception
         context.pop('__auth_audit', None)
 
-        # Local harvest source organization
-        source_dataset = p.toolkit.get_action('package_show')(context, {'id': harvest_object.source.id})
-        local_org = source_dataset.get('owner_org')
-
         # Create org
         owner_name = dataset.get('owner_name')
         log.info(f'Organization: {owner_name}')
 
-        context = {
-            'model': model,
-            'session': model.Session,
-            'user': self._get_user_name(),
-            'ignore_auth': True,
-        }
-
         if owner_name is not None:
             local_org = owner_name
+        else:
+            # Local harvest source organization
+            local_org = run_context.cached('source_owner_org', lambda: p.toolkit.get_action('package_show')(
+                context, {'id': harvest_object.source.id}).get('owner_org'))
+
         package_dict['owner_org'] = local_org
 
         # Munge name
@@ -332,182 +480,393 @@ class XRoadHarvesterPlugin(HarvesterBase):
         package_dict['xroad_membercode'] = dataset['xRoadMemberCode']
         package_dict['xroad_subsystemcode'] = subsystem.subsystem_code
 
-        result = self._create_or_update_package(package_dict, harvest_object, package_dict_form='package_show')
+        resource_index = ResourceIndex(package_dict.setdefault('resources', []))
+        resources_changed = False
+        previous_resources = {resource['id']: copy.deepcopy(resource)
+                              for resource in package_dict['resources'] if resource.get('id')}
+
+        duplicate_names = resource_index.duplicate_names()
+        if duplicate_names:
+            log.warning('Package %s has several resources named %s', package_dict['id'], ', '.join(duplicate_names))
+            HarvestObjectExtra(harvest_object_id=harvest_object.id, key='duplicate_resource_names',
+                               value=','.join(duplicate_names)).save()
 
         # Process removed services
         for service in subsystem.services:
-            name = generate_service_name(service)
-
-            named_resources = [r for r in package_dict.get('resources', []) if r.get('name') == name]
-            for resource in named_resources:
+            for resource in resource_index.find(service):
                 new_xroad_removed = service.removed is not None
                 xroad_removed = p.toolkit.asbool(resource.get('xroad_removed', False))
                 if xroad_removed != new_xroad_removed:
-                    p.toolkit.get_action('resource_patch')(context, {'id': resource['id'], 'xroad_removed': new_xroad_removed})
+                    resource['xroad_removed'] = new_xroad_removed
+                    resources_changed = True
 
-        if result not in (True, 'unchanged'):
-            return result
+        unknown_service_link_url = run_context.unknown_service_link_url
+        skipped_resource_uploads = 0
+        upload_files = []
 
-        unknown_service_link_url = p.toolkit.config.get('ckanext.xroad_integration.unknown_service_link_url')
+        try:
+            for service in subsystem.services:
+                # Removed services already processed
+                if service.removed:
+                    continue
 
-        for service in subsystem.services:
-            # Removed services already processed
-            if service.removed:
-                continue
+                changed, skipped = self._update_service_resources(harvest_object, package_dict, resource_index, subsystem,
+                                                                  service, unknown_service_link_url, upload_files)
+                resources_changed = resources_changed or changed
+                skipped_resource_uploads += skipped
 
-            # Parse service name, version and description
-
-            name = generate_service_name(service)
-
-            # Determine description type and content
-            if service.wsdl:
-                service_description_type = 'wsdl'
-                service_description_data = service.wsdl.data
-                changed = service.wsdl.changed
-            elif service.openapi:
-                service_description_type = 'openapi'
-                service_description_data = service.openapi.data
-                changed = service.openapi.changed
-            elif service.rest_services:
-                service_description_type = 'rest'
-                service_description_data = json.dumps(generate_openapi(service))
-                changed = service.changed
-            else:
-                service_description_type = 'unknown'
-                service_description_data = None
-                changed = service.changed
-
-            # Construct updated resource data
-
-            resource_data = {
-                'package_id': package_dict['id'],
-                'name': name,
-                'xroad_servicecode': service.service_code,
-                'xroad_serviceversion': service.service_version,
-                'xroad_service_type': service.service_type,
-                'harvested_from_xroad': True,
-                'access_restriction_level': 'public'
-            }
+            # Package metadata and all resource changes are written and indexed at once
+            if resources_changed:
+                package_dict.pop('metadata_modified', None)
 
-            if service_description_data is not None:
-                service_description_data_utf8 = service_description_data.encode('utf-8')
-
-                if service_description_type == 'wsdl':
-                    valid_content = self._is_valid_wsdl(service_description_data_utf8)
-                    timestamp_field = 'wsdl_timestamp'
-                    target_name = 'service.wsdl'
-                    resource_format = 'wsdl'
-                elif service_description_type == 'openapi':
-                    # TODO: Validity of openapi ?
-                    valid_content = True
-                    timestamp_field = 'openapi_timestamp'
-                    target_name = 'service.json'
-                    resource_format = 'openapi-json'
-                elif service_description_type == 'rest':
-                    valid_content = True
-                    timestamp_field = 'rest_timestamp'
-                    target_name = 'service.json'
-                    resource_format = 'rest'
-                else:
-                    log.error('Unhandled service description type: {}!'.format(service_description_type))
-                    continue
+            result = self._save_package(package_dict, previous_resources, harvest_object)
+        finally:
+            for upload_file in upload_files:
+                upload_file.close()
 
-                with tempfile.NamedTemporaryFile(delete=False) as f:
-                    f.write(service_description_data_utf8)
-                    file_name = f.name
+        if skipped_resource_uploads:
+            HarvestObjectExtra(harvest_object_id=harvest_object.id, key='skipped_resource_uploads',
+                               value=str(skipped_resource_uploads)).save()
 
-                # Prepare file upload
-                content_length = len(service_description_data_utf8)
-                log.debug('Uploading service %s description (size: %d bytes)',
-                          service_version_name(service.service_code, service.service_version), content_length)
-                resource_data['upload'] = FlaskFileStorage(open(file_name, 'rb'), target_name, content_length=content_length)
-                resource_data['format'] = resource_format
-                resource_data['valid_content'] = 'yes' if valid_content else 'no'
-            elif unknown_service_link_url is None:
-                log.warn('Unknown type service %s.%s harvested, but '
-                         'ckanext.xroad_integration.unknown_service_link_url is not set!',
-                         package_dict['id'], name)
+        log.info('Created API %s', package_dict['name'])
+
+        return result
+
+    def _save_package(self, package_dict, previous_resources, harvest_object):
+        '''Creates or updates the package, leaving out resources that fail validation
+
+        An invalid resource would fail the write of the whole package. If the write fails on invalid resources,
+        those are excluded and the write is retried once. Otherwise errors are saved like in
+        `_create_or_update_package`.
+        '''
+        try:
+            try:
+                return self._write_package(package_dict, harvest_object)
+            except p.toolkit.ValidationError as e:
+                if not self._exclude_invalid_resources(package_dict, previous_resources, e.error_dict,
+                                                       harvest_object):
+                    raise
+                log.info('Retrying write of %s without invalid resources', package_dict['id'])
+                return self._write_package(package_dict, harvest_object)
+        except p.toolkit.ValidationError as e:
+            log.exception(e)
+            self._save_object_error('Invalid package with GUID %s: %r' % (harvest_object.guid, e.error_dict),
+                                    harvest_object, 'Import')
+        except Exception as e:
+            log.exception(e)
+            self._save_object_error('%r' % e, harvest_object, 'Import')
+
+        return None
+
+    def _write_package(self, package_dict, harvest_object):
+        '''Same as `_create_or_update_package` with the package_show form, but raises validation errors'''
+        schema = default_create_package_schema()
+        schema['id'] = [ignore_missing, unicode_safe]
+        schema['__junk'] = [ignore]
+        context = {
+            'model': model,
+            'session': model.Session,
+            'user': self._user_name(),
+            'schema': schema,
+            'ignore_auth': True,
+        }
+
+        try:
+            existing_package_dict = self._find_existing_package(package_dict)
+        except NotFound:
+            existing_package_dict = None
+
+        if existing_package_dict is not None:
+            # In case name has been modified when first importing
+            package_dict['name'] = existing_package_dict['name']
+            if 'metadata_modified' in package_dict and \
+                    package_dict['metadata_modified'] <= existing_package_dict.get('metadata_modified'):
+                log.info('No changes to package with GUID %s, skipping...' % harvest_object.guid)
+                return 'unchanged'
+
+            for field in p.toolkit.aslist(p.toolkit.config.get('ckan.harvest.not_overwrite_fields')):
+                if field in existing_package_dict:
+                    package_dict[field] = existing_package_dict[field]
+        else:
+            package_dict['name'] = self._gen_new_name(package_dict.get('name') or package_dict['title'])
+
+        # The write pops uploads from the resources, so each attempt is given its own copy
+        data_dict = dict(package_dict, resources=[dict(resource) for resource in package_dict.get('resources', [])])
+
+        if existing_package_dict is not None:
+            log.info('Package with GUID %s exists and needs to be updated' % harvest_object.guid)
+            context['id'] = data_dict['id']
+            new_package = p.toolkit.get_action('package_update')(context, data_dict)
+
+            # Flag the other objects linking to this package as not current anymore
+            model.Session.query(HarvestObject).filter(HarvestObject.package_id == new_package['id']) \
+                .update({'current': False}, synchronize_session=False)
+            harvest_object.package_id = new_package['id']
+            harvest_object.current = True
+            harvest_object.save()
+        else:
+            log.info('Package with GUID %s does not exist, let\'s create it' % harvest_object.guid)
+            harvest_object.current = True
+            harvest_object.package_id = data_dict['id']
+            harvest_object.add()
+
+            # The dataset is indexed with the harvest object id, so the object is flushed before the package exists
+            model.Session.execute(text('SET CONSTRAINTS harvest_object_package_id_fkey DEFERRED'))
+            model.Session.flush()
+
+            p.toolkit.get_action('package_create')(context, data_dict)
+
+        model.Session.commit()
+        return True
+
+    def _exclude_invalid_resources(self, package_dict, previous_resources, error_dict, harvest_object) -> bool:
+        '''Excludes the resources named in the validation errors of a package write
+
+        New invalid resources are left out and updated invalid resources are restored to their previous values.
+        An error is saved for each excluded resource. Returns False if no resource failed validation.
+        '''
+        resource_errors = error_dict.get('resources') if isinstance(error_dict, dict) else None
+        if not isinstance(resource_errors, list) or not any(resource_errors):
+            return False
+
+        resources = []
+        for resource, resource_error in zip(package_dict['resources'], resource_errors):
+            if not resource_error:
+                resources.append(resource)
                 continue
+
+            self._save_object_error(f'Invalid resource {resource.get("name")} of {package_dict["id"]} '
+                                    f'in {harvest_object.id}: {resource_error!r}', harvest_object, 'Import')
+            previous = previous_resources.get(resource.get('id'))
+            if previous is not None:
+                resources.append(previous)
+
+        # Resources beyond the reported errors are valid
+        resources.extend(package_dict['resources'][len(resource_errors):])
+        package_dict['resources'] = resources
+        return True
+
+    def _update_service_resources(self, harvest_object, package_dict, resource_index, subsystem, service,
+                                  unknown_service_link_url, upload_files) -> Tuple[bool, int]:
+        '''Creates or updates the resources of a service in package_dict
+
+        Uploads are opened as files appended to upload_files, which the caller closes after writing the package.
+        Returns whether any resource was changed and the number of uploads skipped as unchanged.
+        '''
+        name = generate_service_name(service)
+
+        # Determine description type, the content is only loaded if the resource needs to be written
+        if service.wsdl:
+            service_description_type = 'wsdl'
+            description = service.wsdl
+            changed = service.wsdl.changed
+        elif service.openapi:
+            service_description_type = 'openapi'
+            description = service.openapi
+            changed = service.openapi.changed
+        elif service.rest_services:
+            service_description_type = 'rest'
+            description = None
+            changed = service.changed
+        else:
+            service_description_type = 'unknown'
+            description = None
+            changed = service.changed
+
+        has_service_description = (service_description_type == 'rest' or (
+            description is not None and (description.data is not None or description.data_ref is not None)))
+
+        # Construct updated resource data
+
+        resource_data = {
+            'name': name,
+            'xroad_servicecode': service.service_code,
+            'xroad_serviceversion': service.service_version,
+            'xroad_service_type': service.service_type,
+            'harvested_from_xroad': True,
+            'access_restriction_level': 'public'
+        }
+
+        if has_service_description:
+            if service_description_type == 'wsdl':
+                timestamp_field = 'wsdl_timestamp'
+                target_name = 'service.wsdl'
+                resource_format = 'wsdl'
+            elif service_description_type == 'openapi':
+                timestamp_field = 'openapi_timestamp'
+                target_name = 'service.json'
+                resource_format = 'openapi-json'
+            elif service_description_type == 'rest':
+                timestamp_field = 'rest_timestamp'
+                target_name = 'service.json'
+                resource_format = 'rest'
             else:
-                file_name = None
-                resource_data['url'] = unknown_service_link_url
-                timestamp_field = 'unknown_timestamp'
+                log.error('Unhandled service description type: {}!'.format(service_description_type))
+                return False, 0
+
+            resource_data['format'] = resource_format
+        elif unknown_service_link_url is None:
+            log.warn('Unknown type service %s.%s harvested, but '
+                     'ckanext.xroad_integration.unknown_service_link_url is not set!',
+                     package_dict['id'], name)
+            return False, 0
+        else:
+            resource_data['url'] = unknown_service_link_url
+            timestamp_field = 'unknown_timestamp'
 
-            # Insert REST endpoints
-            if service.service_type.lower() == 'rest':
-                rest_services = service.rest_services.services if service.rest_services else []
-                endpoints = [endpoint.as_dict()
-                             for rest_service in rest_services
-                             for endpoint in rest_service.endpoints]
-                resource_data['rest_endpoints'] = {'endpoints': endpoints}
+        # Insert REST endpoints
+        if service.service_type.lower() == 'rest':
+            rest_services = service.rest_services.services if service.rest_services else []
+            endpoints = [endpoint.as_dict()
+                         for rest_service in rest_services
+                         for endpoint in rest_service.endpoints]
+            resource_data['rest_endpoints'] = {'endpoints': endpoints}
+
+        # Update timestamp
+        resource_data[timestamp_field] = changed.strftime('%Y-%m-%dT%H:%M:%S')
+
+        named_resources = resource_index.find(service)
 
-            # Update timestamp
-            resource_data[timestamp_field] = changed.strftime('%Y-%m-%dT%H:%M:%S')
+        # Select resources to create or update, None stands for a new resource
 
-            named_resources = [r for r in package_dict.get('resources', []) if r.get('name') == name]
+        if not named_resources:
+            targets = [None]
+        else:
+            targets = []
+            for resource in named_resources:
+                try:
+                    previous_string = resource.get(timestamp_field, None)
+                    previous = iso8601.parse_date(previous_string) if previous_string else None
+                except iso8601.ParseError as e:
+                    log.error('Error parsing previous timestamp: %s' % e)
+                    continue
 
-            # Create or update resources
+                if not previous or (changed and changed > previous) or self.config.get('force_resource_update'):
+                    log.info('Service %s.%s changed after last harvest, replacing...',
+                             resource.get('xroad_servicecode'), resource.get('xroad_serviceversion'))
+                    targets.append(resource)
 
+        if not targets:
+            return False, 0
+
+        skipped = 0
+        unchanged_resources = []
+        service_description_data_utf8 = None
+        if has_service_description:
             try:
-                if not named_resources:
-                    p.toolkit.get_action('resource_create')(context, resource_data)
-                    result = True
+                if service_description_type == 'rest':
+                    service_description_data = json.dumps(generate_openapi(service))
                 else:
-                    for resource in named_resources:
-                        try:
-                            previous_string = resource.get(timestamp_field, None)
-                            previous = iso8601.parse_date(previous_string) if previous_string else None
-                        except iso8601.ParseError as e:
-                            log.error('Error parsing previous timestamp: %s' % e)
-                            continue
-
-                        if not previous or (changed and changed > previous) or self.config.get('force_resource_update'):
-                            log.info('Service %s.%s changed after last harvest, replacing...',
-                                     resource.get('xroad_servicecode'), resource.get('xroad_serviceversion'))
-                            resource_data['id'] = resource['id']
-                            p.toolkit.get_action('resource_patch')(context, resource_data)
-                            result = True
-            except p.toolkit.ValidationError as e:
-                log.warning(f'Validation error while updating/creating {name}: {e}')
-                self._save_object_error(f'Validation error processing {owner_name}.{subsystem.subsystem_code}.{name} '
-                                        f'in {harvest_object.id}', harvest_object, 'Import')
-            except SearchIndexError as e:
-                log.warning(f'Indexing error while updating/creating {name}: {e}')
-                self._save_object_error(f'Indexing error processing {owner_name}.{subsystem.subsystem_code}.{name} '
-                                        f'in {harvest_object.id}', harvest_object, 'Import')
+                    service_description_data = self._load_service_description(description)
+            except BlobNotFound as e:
+                log.warning(f'Service description {e} of {name} is missing from the blob store')
+                self._save_object_error(f'Missing service description for {package_dict.get("owner_org")}.'
+                                        f'{subsystem.subsystem_code}.{name} in {harvest_object.id}',
+                                        harvest_object, 'Import')
+                return False, 0
+
+            service_description_data_utf8 = service_description_data.encode('utf-8')
+
+            # Identical content is not uploaded again
+            content_digest = hashlib.sha256(service_description_data_utf8).hexdigest()
+            content_size = str(len(service_description_data_utf8))
+            unchanged_resources = [resource for resource in targets
+                                   if resource is not None
+                                   and resource.get('xroad_content_digest') == content_digest
+                                   and str(resource.get('xroad_content_size')) == content_size]
+            if unchanged_resources:
+                log.info('Service %s description content is unchanged, skipping %d uploads',
+                         service_version_name(service.service_code, service.service_version),
+                         len(unchanged_resources))
+                skipped = len(unchanged_resources)
+
+            resource_data['xroad_content_digest'] = content_digest
+            resource_data['xroad_content_size'] = content_size
+
+            if service_description_type == 'wsdl':
+                valid_content = self._is_valid_wsdl(service_description_data_utf8)
+            else:
+                # TODO: Validity of openapi ?
+                valid_content = True
+            resource_data['valid_content'] = 'yes' if valid_content else 'no'
 
-            if file_name:
-                os.unlink(file_name)
+        # Create or update resources, uploads are stored when the package is written
 
-        log.info('Created API %s', package_dict['name'])
+        resources_changed = False
+        for resource in targets:
+            unchanged = resource is not None and any(resource is other for other in unchanged_resources)
+            if resource is None:
+                resource = resource_index.add(dict(resource_data))
+            else:
+                # Resources with identical content and metadata are left as they are. Their timestamp is not
+                # updated either, as that alone would cause a write of the package.
+                if (unchanged or service_description_data_utf8 is None) and \
+                        not self._resource_data_changed(resource, resource_data, ignored_keys=(timestamp_field,)):
+                    continue
+                resource_index.update(resource, resource_data)
+            resources_changed = True
 
-        return result
+            # Identical content keeps the previous upload
+            if service_description_data_utf8 is not None and not unchanged:
+                upload_file = self._open_upload(description, service_description_data_utf8)
+                upload_files.append(upload_file)
 
-    def _get_xroad_catalog(self, url, start_date: str):
-        # type: (str, str) -> dict
+                content_length = len(service_description_data_utf8)
+                log.debug('Uploading service %s description (size: %d bytes)',
+                          service_version_name(service.service_code, service.service_version), content_length)
+                resource['upload'] = FlaskFileStorage(upload_file, target_name, content_length=content_length)
 
+        return resources_changed, skipped
+
+    @staticmethod
+    def _resource_data_changed(resource: Dict[str, Any], resource_data: Dict[str, Any], ignored_keys=()) -> bool:
+        '''Returns whether writing resource_data would change any value of the resource
+
+        Values may have been converted by the dataset schema, so booleans and JSON objects are compared by value.
+        '''
+        for key, value in resource_data.items():
+            if key in ignored_keys:
+                continue
+            current = resource.get(key)
+            if isinstance(value, bool):
+                current = p.toolkit.asbool(current) if current is not None else None
+            elif isinstance(value, dict) and isinstance(current, str):
+                try:
+                    current = json.loads(current)
+                except ValueError:
+                    return True
+            if current != value:
+                return True
+        return False
+
+    def _get_xroad_catalog(self, url, start_date: str) -> Iterator[Union[Member, Error]]:
+        '''Yields members from ListMembers one by one while the response is still being downloaded'''
         start_of_next_day = (datetime.today() + timedelta(days=1)).strftime('%Y-%m-%d')
 
         try:
             log.info('Searching for apis modified from: %s UTC to %s UTC' % (start_date, start_of_next_day))
-            r = http.get(url + '/Consumer/ListMembers', params={'startDateTime': start_date,
-                                                                'endDateTime': start_of_next_day},
-                         headers={'Accept': 'application/json'})
-        except ConnectionError:
+            r = get_session().get(url + '/Consumer/ListMembers',
+                                  params={'startDateTime': start_date, 'endDateTime': start_of_next_day},
+                                  headers={'Accept': 'application/json'}, stream=True, endpoint='ListMembers')
+        except TRANSPORT_ERRORS:
             raise ContentFetchError('Calling XRoad service ListMembers failed!')
-        if r.status_code != requests.codes.ok:
-            raise ContentFetchError('Calling XRoad service ListMembers failed!')
-        try:
-            result = r.json()
-        except ValueError:
-            raise ContentFetchError('ListMembers JSON parse failed')
-        return result
+
+        with r:
+            if r.status_code != requests.codes.ok:
+                raise ContentFetchError('Calling XRoad service ListMembers failed!')
+
+            # Let urllib3 handle content encodings while ijson reads the raw stream
+            r.raw.decode_content = True
+            try:
+                yield from iter_member_list(r.raw)
+            except Urllib3HTTPError:
+                raise ContentFetchError('Reading XRoad service ListMembers response failed!')
 
     def _get_wsdl(self, url, external_id):
         try:
-            r = http.get(url + '/Consumer/GetWsdl', params={'externalId': external_id},
-                         headers={'Accept': 'application/json'})
-        except ConnectionError:
+            r = get_session().get(url + '/Consumer/GetWsdl', params={'externalId': external_id},
+                                  headers={'Accept': 'application/json'}, endpoint='GetWsdl')
+        except TRANSPORT_ERRORS:
             raise ContentFetchError('Calling XRoad service GetWsdl failed!')
         if r.status_code != requests.codes.ok:
             raise ContentFetchError('Calling XRoad service GetWsdl failed!')
@@ -515,9 +874,9 @@ class XRoadHarvesterPlugin(HarvesterBase):
 
     def _get_openapi(self, url, external_id):
         try:
-            r = http.get(url + '/Consumer/GetOpenAPI', params={'externalId': external_id},
-                         headers={'Accept': 'application/json'})
-        except ConnectionError:
+            r = get_session().get(url + '/Consumer/GetOpenAPI', params={'externalId': external_id},
+                                  headers={'Accept': 'application/json'}, endpoint='GetOpenAPI')
+        except TRANSPORT_ERRORS:
             raise ContentFetchError('Calling XRoad service GetOpenAPI failed!')
         if r.status_code != requests.codes.ok:
             raise ContentFetchError('Calling XRoad service GetOpenAPI failed!')
@@ -536,8 +895,8 @@ class XRoadHarvesterPlugin(HarvesterBase):
             if service_version:
                 params['serviceVersion'] = service_version
 
-            r = http.get(url + '/Consumer/GetServiceType', params=params,
-                         headers={'Accept': 'application/json'})
+            r = get_session().get(url + '/Consumer/GetServiceType', params=params,
+                                  headers={'Accept': 'application/json'}, endpoint='GetServiceType')
 
             response_json = r.json()
 
@@ -547,7 +906,7 @@ class XRoadHarvesterPlugin(HarvesterBase):
             if response_json.get('type'):
                 return response_json.get('type')
 
-        except ConnectionError:
+        except TRANSPORT_ERRORS:
             raise ContentFetchError('Calling XRoad service GetServiceType failed')
 
         return ''
@@ -555,10 +914,10 @@ class XRoadHarvesterPlugin(HarvesterBase):
     @staticmethod
     def _get_member_type(url, xroad_instance, member_class, member_code):
         try:
-            r = http.get(url + '/Consumer/IsProvider', params={'xRoadInstance': xroad_instance,
-                                                               'memberClass': member_class,
-                                                               'memberCode': member_code},
-                         headers={'Accept': 'application/json'})
+            r = get_session().get(url + '/Consumer/IsProvider', params={'xRoadInstance': xroad_instance,
+                                                                        'memberClass': member_class,
+                                                                        'memberCode': member_code},
+                                  headers={'Accept': 'application/json'}, endpoint='IsProvider')
 
             is_provider = asbool(r.json().get('provider'))
 
@@ -567,7 +926,7 @@ class XRoadHarvesterPlugin(HarvesterBase):
             elif is_provider is False:
                 return 'consumer'
 
-        except ConnectionError:
+        except TRANSPORT_ERRORS:
             raise ContentFetchError('Calling XRoad service IsProvider failed')
 
         return ''
@@ -650,48 +1009,6 @@ class XRoadHarvesterPlugin(HarvesterBase):
 
         return site_user['apikey']
 
-    def _ensure_own_unique_name(self, org_id, org_name, context):
-        organization_show_action = p.toolkit.get_action('organization_show')
-
-        def organization_show(name_or_id):
-            return organization_show_action(context, {
-                'id': name_or_id,
-                'include_datasets': False,
-                'include_dataset_count': False,
-                'include_extras': False,
-                'include_users': False,
-                'include_groups': False,
-                'include_tags': False,
-                'include_followers': False})
-
-        # Find any existing organization with the name
-        try:
-            org_with_name = organization_show(org_name)
-        except NotFound:
-            org_with_name = None
-
-        # If the name is free or already reserved to this organization, reuse the name
-        if org_with_name is None or org_with_name['id'] == org_id:
-            return org_name
-
-        # Try to get current name as fallback
-        try:
-            org = organization_show(org_id)
-            return org['name']
-        except NotFound:
-            pass
-
-        # Try to find a fallback with a limited pool of variants
-        name_candidates = ('%s_%i' % (org_name, i) for i in range(2, 20))
-        for name in name_candidates:
-            try:
-                organization_show(name)
-            except NotFound:
-                return name
-
-        # All variants were taken as well, probably some kind of error
-        return None
-
     def _create_or_update_organization(self, org_id, member, harvest_job) -> Optional[Dict[str, Any]]:
         '''Creates or updates an organization based on member.
         Raises a ValidationError if contents are invalid or there's no suitable name available
@@ -700,27 +1017,25 @@ class XRoadHarvesterPlugin(HarvesterBase):
         context = {
             'model': model,
             'session': model.Session,
-            'user': self._get_user_name(),
+            'user': self._user_name(),
             'ignore_auth': True,
         }
 
+        organization_index = self.run_context.cached('organization_index', OrganizationIndex.load)
         munged_title = munge_title_to_name(member.name)
 
-        try:
-            org = p.toolkit.get_action('organization_show')(context, {'id': org_id})
-        except NotFound:
-            org = None
+        org = organization_index.get(org_id)
 
         if org:
             if self.config.get('force_all', False) is True:
                 last_time = iso8601.parse_date('2011-01-01')
             else:
-                last_time = self._last_error_free_job_time(harvest_job)
+                last_time = self._job_last_error_free_job_time(harvest_job)
                 if last_time is not None:
                     last_time = iso8601.parse_date(last_time)
 
             new_xroad_removed = member.removed is not None
-            current_xroad_removed = p.toolkit.asbool(org.get('xroad_removed', False))
+            current_xroad_removed = organization_index.is_removed(org)
 
             changed_since_last_harvest = last_time and last_time < member.changed
             forced_update = self.config.get('force_organization_update') is True
@@ -730,11 +1045,17 @@ class XRoadHarvesterPlugin(HarvesterBase):
                 if org['name'] == munged_title:
                     org_name = munged_title
                 else:
-                    org_name = self._ensure_own_unique_name(org_id, munged_title, context)
+                    org_name = organization_index.unique_name(org['id'], munged_title)
 
                 if org_name is None:
                     raise p.toolkit.ValidationError(f'Organization name {munged_title} and tried variants already in use!')
 
+                org = p.toolkit.get_action('organization_show')(context, {'id': org['id']})
+
+                # Get rid of auth audit on the context otherwise we'll get an
+                # exception
+                context.pop('__auth_audit', None)
+
                 org_description = org.get('description_translated', {}) \
                     if (org.get('description_translated') != {'fi': '', 'sv': '', 'en': ''}
                         and org.get('description_translated') != {'fi': ''}) \
@@ -746,7 +1067,7 @@ class XRoadHarvesterPlugin(HarvesterBase):
                 org_data = {
                     'title_translated': {'fi': member.name},
                     'name': org_name,
-                    'id': org_id,
+                    'id': org['id'],
                     'xroad_instance': member.instance,
                     'xroad_memberclass': member.member_class,
                     'xroad_membercode': member.member_code,
@@ -763,6 +1084,7 @@ class XRoadHarvesterPlugin(HarvesterBase):
 
                 log.info(f'Patching organization {org_name}')
                 org = p.toolkit.get_action('organization_patch')(context, org_data)
+                organization_index.update(org)
 
         else:
             log.info(f'Organization {member.name} not found, creating...')
@@ -771,19 +1093,11 @@ class XRoadHarvesterPlugin(HarvesterBase):
                 log.info('Organization was removed, not creating..')
                 return None
 
-            # Get rid of auth audit on the context otherwise we'll get an
-            # exception
-            context.pop('__auth_audit', None)
-
-            org_name = self._ensure_own_unique_name(org_id, munged_title, context)
+            org_name = organization_index.unique_name(org_id, munged_title)
 
             if org_name is None:
                 raise p.toolkit.ValidationError(f'Organization name {munged_title} and tried variants already in use!')
 
-            # Get rid of auth audit on the context otherwise we'll get an
-            # exception
-            context.pop('__auth_audit', None)
-
             org_data = {
                 'title_translated': {'fi': member.name},
                 'name': org_name,
@@ -797,26 +1111,147 @@ class XRoadHarvesterPlugin(HarvesterBase):
 
             log.info(f'Creating organization {org_name}')
             org = p.toolkit.get_action('organization_create')(context, org_data)
+            organization_index.update(org)
 
         return org
 
     def _is_valid_wsdl(self, text_content):
+        '''Checks that a service description is well-formed XML and not a SOAP fault
+
+        The content is parsed incrementally and the check stops at the first decisive element: a WSDL root
+        element makes the content valid and a SOAP fault invalid. Nesting deeper than WSDL_MAX_DEPTH is
+        invalid, and content beyond WSDL_MAX_SCAN_BYTES is not examined.
+        '''
+        text_bytes = text_content.encode('utf-8') if type(text_content) is six.text_type else text_content
+        parser = etree.XMLPullParser(events=('start', 'end'), resolve_entities=False, no_network=True)
+        depth = 0
+
         try:
-            text_bytes = text_content.encode('utf-8') if type(text_content) is six.text_type else text_content
-            wsdl_content = etree.fromstring(text_bytes)
-            xml_namespaces = {
-                    'soap-env': 'http://schemas.xmlsoap.org/soap/envelope/',
-                    'xsd': 'http://www.w3.org/2001/XMLSchema'}
-
-            soap_faults = wsdl_content.xpath('//soap-env:Fault', namespaces=xml_namespaces)
-            if len(soap_faults) > 0:
-                return False
+            scan_length = min(len(text_bytes), WSDL_MAX_SCAN_BYTES)
+            for offset in range(0, scan_length, WSDL_SCAN_CHUNK_SIZE):
+                parser.feed(text_bytes[offset:min(offset + WSDL_SCAN_CHUNK_SIZE, scan_length)])
+                for event, element in parser.read_events():
+                    if event == 'start':
+                        depth += 1
+                        if depth > WSDL_MAX_DEPTH:
+                            return False
+                        if element.tag == SOAP_FAULT_TAG:
+                            return False
+                        if depth == 1 and element.tag in WSDL_ROOT_TAGS:
+                            return True
+                    else:
+                        depth -= 1
+                        # Only the path to the current element is kept in memory
+                        element.clear()
+                        # The root element may be preceded by comments and processing instructions without a parent
+                        while element.getprevious() is not None and element.getparent() is not None:
+                            del element.getparent()[0]
+
+            if len(text_bytes) > WSDL_MAX_SCAN_BYTES:
+                return True
+
+            parser.close()
         except etree.XMLSyntaxError:
             return False
 
         return True
 
 
+class ResourceIndex(object):
+    '''Resources of a package indexed by name and by X-Road service code and version
+
+    Resources are matched to services by service code and version. Resources without any X-Road keys predate
+    them and are matched by name instead, so a renamed resource of another service is never taken over.
+    The index is kept up to date with `add` and `update`.
+    '''
+
+    def __init__(self, resources: List[Dict[str, Any]]):
+        self.resources = resources
+        self.by_name: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        self.by_service: Dict[Tuple[Optional[str], Optional[str]], List[Dict[str, Any]]] = {}
+        for resource in resources:
+            self._index(resource)
+
+    @staticmethod
+    def _service_key(resource: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+        # Services without a version may have been stored with an empty version
+        return resource.get('xroad_servicecode'), resource.get('xroad_serviceversion') or None
+
+    def _index(self, resource: Dict[str, Any]):
+        self.by_name.setdefault(resource.get('name'), []).append(resource)
+        if resource.get('xroad_servicecode') is not None:
+            self.by_service.setdefault(self._service_key(resource), []).append(resource)
+
+    def _unindex(self, resource: Dict[str, Any]):
+        for index, key in ((self.by_name, resource.get('name')), (self.by_service, self._service_key(resource))):
+            indexed = index.get(key, [])
+            indexed[:] = [r for r in indexed if r is not resource]
+
+    @staticmethod
+    def _has_xroad_keys(resource: Dict[str, Any]) -> bool:
+        return any(key.startswith('xroad_') for key in resource)
+
+    def find(self, service: Service) -> List[Dict[str, Any]]:
+        resources = None
+        if service.service_code is not None:
+            resources = self.by_service.get((service.service_code, service.service_version or None))
+        if not resources:
+            resources = [resource for resource in self.by_name.get(generate_service_name(service), [])
+                         if not self._has_xroad_keys(resource)]
+        return list(resources)
+
+    def duplicate_names(self) -> List[str]:
+        return sorted(name for name, resources in self.by_name.items() if name and len(resources) > 1)
+
+    def add(self, resource: Dict[str, Any]) -> Dict[str, Any]:
+        self.resources.append(resource)
+        self._index(resource)
+        return resource
+
+    def update(self, resource: Dict[str, Any], data: Dict[str, Any]):
+        self._unindex(resource)
+        resource.update(data)
+        self._index(resource)
+
+
+class HarvestObjectBatch(object):
+    '''Collects harvest objects of a job and inserts them in chunks, committing once per chunk
+
+    Rows are inserted directly into the harvest object table, so the source id is set here
+    instead of by the harvest object insert listener.
+    '''
+
+    def __init__(self, harvest_job, batch_size: int):
+        self.harvest_job_id = harvest_job.id
+        self.harvest_source_id = harvest_job.source_id
+        self.batch_size = batch_size
+        self.pending: List[Dict[str, Any]] = []
+        self.object_ids: List[str] = []
+
+    def add(self, guid: str, content: str):
+        self.pending.append({
+            'id': make_uuid(),
+            'guid': guid,
+            'content': content,
+            'harvest_job_id': self.harvest_job_id,
+            'harvest_source_id': self.harvest_source_id,
+        })
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        model.Session.execute(sa_inspect(HarvestObject).local_table.insert(), self.pending)
+        model.Session.commit()
+        log.debug('Inserted %d harvest objects', len(self.pending))
+
+        self.object_ids.extend(row['id'] for row in self.pending)
+        self.pending = []
+
+
 def generate_service_name(service) -> Optional[str]:
     if service.service_code is None:
         return None
@@ -0,0 +1,86 @@
+import logging
+from typing import Optional, Dict, Any
+
+from ckan import model
+from ckan.plugins import toolkit
+
+log = logging.getLogger(__name__)
+
+XROAD_ORGANIZATION_EXTRAS = ('xroad_instance', 'xroad_memberclass', 'xroad_membercode', 'xroad_removed')
+
+
+class OrganizationIndex(object):
+    '''In-memory index of existing organizations used to resolve X-Road members during gather
+
+    - `organizations` maps organization ids to dicts with the organization `id`, `name`, `state` and
+      the X-Road extras of the organization
+    - `taken_names` maps every group and organization name in use to the id of its owner
+    '''
+
+    def __init__(self, organizations: Dict[str, Dict[str, Any]], taken_names: Dict[str, str]):
+        self.organizations = organizations
+        self.taken_names = taken_names
+
+    @classmethod
+    def load(cls):
+        # Group names are unique regardless of type, so groups reserve names as well
+        groups = model.Session.query(model.Group.id, model.Group.name, model.Group.state,
+                                     model.Group.is_organization).all()
+
+        taken_names = {name: group_id for group_id, name, _, _ in groups}
+        organizations = {group_id: {'id': group_id, 'name': name, 'state': state}
+                         for group_id, name, state, is_organization in groups
+                         if is_organization}
+
+        extras = (model.Session.query(model.GroupExtra.group_id, model.GroupExtra.key, model.GroupExtra.value)
+                  .join(model.Group, model.Group.id == model.GroupExtra.group_id)
+                  .filter(model.Group.is_organization == True)  # noqa
+                  .filter(model.GroupExtra.key.in_(XROAD_ORGANIZATION_EXTRAS))
+                  .filter(model.GroupExtra.state == 'active'))
+
+        for group_id, key, value in extras:
+            organizations[group_id][key] = value
+
+        log.info('Loaded %d organizations and %d reserved names', len(organizations), len(taken_names))
+        return cls(organizations, taken_names)
+
+    def get(self, id_or_name: str) -> Optional[Dict[str, Any]]:
+        organization = self.organizations.get(id_or_name)
+        if organization is None:
+            owner_id = self.taken_names.get(id_or_name)
+            organization = self.organizations.get(owner_id) if owner_id else None
+        return organization
+
+    def is_removed(self, organization: Dict[str, Any]) -> bool:
+        return toolkit.asbool(organization.get('xroad_removed', False))
+
+    def unique_name(self, org_id: str, org_name: str) -> Optional[str]:
+        '''Returns a name for the organization, preferring org_name, or None if no suitable name is free'''
+        owner_id = self.taken_names.get(org_name)
+
+        # If the name is free or already reserved to this organization, reuse the name
+        if owner_id is None or owner_id == org_id:
+            return org_name
+
+        # Use current name as fallback
+        organization = self.organizations.get(org_id)
+        if organization is not None:
+            return organization['name']
+
+        # Try to find a fallback with a limited pool of variants
+        name_candidates = ('%s_%i' % (org_name, i) for i in range(2, 20))
+        return next((name for name in name_candidates if name not in self.taken_names), None)
+
+    def update(self, organization: Dict[str, Any]):
+        '''Records an organization created or patched through the action layer'''
+        previous = self.organizations.get(organization['id'])
+        if previous is not None and self.taken_names.get(previous['name']) == organization['id']:
+            del self.taken_names[previous['name']]
+
+        self.organizations[organization['id']] = {
+            'id': organization['id'],
+            'name': organization['name'],
+            'state': organization.get('state'),
+            **{key: organization.get(key) for key in XROAD_ORGANIZATION_EXTRAS if key in organization}
+        }
+        self.taken_names[organization['name']] = organization['id']
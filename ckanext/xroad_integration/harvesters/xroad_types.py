@@ -1,7 +1,14 @@
+import hashlib
+import json
 from dataclasses import dataclass, field
-from typing import Optional, List
+from typing import Optional, List, Iterator, Union, IO
 from datetime import datetime
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 from .xroad_types_utils import (Base, optional, date_value, class_value, xroad_list_value,
                                 xroad_service_version_value, class_list_value)
 
@@ -61,6 +68,8 @@ class ServiceDescription(Base):
     fetched: datetime
     removed: Optional[datetime] = field(default=None)
     data: Optional[str] = field(default=None)
+    # Digest of data in the blob store, set instead of data when the blob store is available
+    data_ref: Optional[str] = field(default=None)
 
 
 @dataclass
@@ -76,6 +85,7 @@ class Service(Base):
             'changed': date_value,
             'fetched': date_value,
             'removed': optional(date_value),
+            'rest_services': optional(class_value(RestServices)),
             }
     service_code: str
     created: datetime
@@ -106,6 +116,25 @@ class Subsystem(Base):
     removed: Optional[datetime] = field(default=None)
     services: List[Service] = field(default_factory=list)
 
+    def fingerprint(self, *context: Optional[str]) -> str:
+        '''Returns a stable digest of the subsystem and the change timestamps of its services.
+
+        Fetch timestamps are left out as they change without the content changing. Additional
+        values affecting the harvested package, such as the owner organization, can be given as `context`.
+        '''
+        def timestamp(value: Optional[datetime]) -> Optional[str]:
+            return value.isoformat() if value else None
+
+        def description(d: Optional[ServiceDescription]):
+            return [d.external_id, timestamp(d.changed), timestamp(d.removed)] if d else None
+
+        services = sorted(([s.service_code, s.service_version, s.service_type,
+                            timestamp(s.changed), timestamp(s.removed),
+                            description(s.wsdl), description(s.openapi)]
+                           for s in self.services), key=json.dumps)
+        content = [list(context), self.subsystem_code, timestamp(self.changed), timestamp(self.removed), services]
+        return hashlib.sha256(json.dumps(content, default=str).encode('utf-8')).hexdigest()
+
 
 @dataclass
 class Member(Base):
@@ -137,3 +166,49 @@ class MemberList(Base):
     value_map = {'members': xroad_list_value('member', Member)}
     members: List[Member] = field(default_factory=list)
     error: Optional[Error] = field(default=None)
+
+
+# Locations of member objects in a ListMembers response, depending on whether the catalog
+# returns the member list as a plain list, as a list wrapped in a dict or as a single member
+MEMBER_PREFIXES = ('memberList.item', 'memberList.member.item', 'memberList.member')
+ERROR_PREFIX = 'error'
+
+
+def iter_member_list(stream: IO[bytes]) -> Iterator[Union[Member, Error]]:
+    '''Parses a ListMembers response incrementally, yielding each Member as soon as it has been read.
+
+    If the response describes an error, the corresponding Error is yielded instead.
+    Falls back to parsing the whole response at once if ijson is not available.
+    '''
+    if ijson is None:
+        try:
+            member_list = MemberList.from_dict(json.load(stream))
+        except (TypeError, KeyError, AttributeError) as e:
+            raise ValueError(f'Invalid member list: {e!r}') from e
+        if member_list.error:
+            yield member_list.error
+        yield from member_list.members
+        return
+
+    builder = None
+    builder_prefix = None
+    try:
+        for prefix, event, value in ijson.parse(stream, use_float=True):
+            if builder is None:
+                if event != 'start_map' or (prefix not in MEMBER_PREFIXES and prefix != ERROR_PREFIX):
+                    continue
+                builder = ijson.ObjectBuilder()
+                builder_prefix = prefix
+
+            builder.event(event, value)
+
+            if event == 'end_map' and prefix == builder_prefix:
+                item_type = Error if builder_prefix == ERROR_PREFIX else Member
+                try:
+                    item = item_type.from_dict(builder.value)
+                except (TypeError, KeyError, AttributeError) as e:
+                    raise ValueError(f'Invalid {item_type.__name__} in member list: {e!r}') from e
+                yield item
+                builder = None
+    except ijson.JSONError as e:
+        raise ValueError(e)
@@ -14,6 +14,13 @@ import base64
 import json
 import six
 import lzma
+import zlib
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 class Base(object):
@@ -47,13 +54,23 @@ class Base(object):
 
     @classmethod
     def deserialize(cls, data):
-        obj = pickle.loads(lzma.decompress(base64.decodebytes(data.encode('utf-8'))))
+        tag, separator, payload = data.partition(CODEC_TAG_SEPARATOR)
+        if not separator:
+            # Payloads without a codec tag predate codecs
+            tag, payload = PickleLzmaCodec.tag, data
+
+        codec = CODECS.get(tag)
+        if codec is None:
+            raise ValueError(f'Unknown serialization codec {tag!r}')
+
+        obj = codec.decode(base64.b64decode(payload), cls)
         if not isinstance(obj, cls):
             raise ValueError(f'Deserialized data describes a {type(obj)}, expected {cls}')
         return obj
 
-    def serialize(self):
-        return base64.encodebytes(lzma.compress(pickle.dumps(self))).decode('utf-8')
+    def serialize(self, codec: Optional[str] = None):
+        codec = CODECS[codec or DEFAULT_CODEC]
+        return codec.tag + CODEC_TAG_SEPARATOR + base64.b64encode(codec.encode(self)).decode('ascii')
 
     # ====== ASSUMPTIONS ======
     # JSON (De)serialization
@@ -126,3 +143,75 @@ def class_list_value(cls):
     def parse(items) -> List[cls]:
         return [cls.from_dict(item) for item in items]
     return parse
+
+
+# Serialization codecs
+#
+# Serialized payloads are prefixed with the tag of the codec used followed by CODEC_TAG_SEPARATOR,
+# which never occurs in base64 encoded data. Untagged payloads are decoded with PickleLzmaCodec.
+
+CODEC_TAG_SEPARATOR = ':'
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class Codec(object):
+    '''Converts data class instances to bytes and back'''
+    tag: str
+
+    def encode(self, obj: Base) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes, cls) -> Base:
+        raise NotImplementedError
+
+
+class PickleLzmaCodec(Codec):
+    '''Original format, kept for reading payloads created by earlier versions'''
+    tag = 'pickle-lzma'
+
+    def encode(self, obj):
+        return lzma.compress(pickle.dumps(obj))
+
+    def decode(self, data, cls):
+        return pickle.loads(lzma.decompress(data))
+
+
+class JsonCodec(Codec):
+    '''Encodes the JSON representation of data classes, compressed with `compress`'''
+
+    def __init__(self, tag: str, compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes]):
+        self.tag = tag
+        self.compress = compress
+        self.decompress = decompress
+
+    def encode(self, obj):
+        return self.compress(json.dumps(obj.as_dict(), default=_json_default, separators=(',', ':')).encode('utf-8'))
+
+    def decode(self, data, cls):
+        return cls.from_dict(json.loads(self.decompress(data)))
+
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+CODECS: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec):
+    CODECS[codec.tag] = codec
+
+
+register_codec(PickleLzmaCodec())
+register_codec(JsonCodec('json-zlib', lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompress))
+
+if zstandard is not None:
+    register_codec(JsonCodec('json-zstd',
+                             lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data),
+                             lambda data: zstandard.ZstdDecompressor().decompress(data)))
+
+DEFAULT_CODEC = 'json-zlib'
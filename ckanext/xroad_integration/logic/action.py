@@ -4,21 +4,25 @@ import os.path
 
 import iso8601
 from dateutil import relativedelta
-from sqlalchemy import and_, not_
+from sqlalchemy import and_, tuple_
+from sqlalchemy.orm import aliased
 
 import datetime
+import itertools
 import six
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ckan import model
-from requests.exceptions import ConnectionError
 from ckan.plugins import toolkit
 from pprint import pformat
 
 from ckanext.xroad_integration.model import (XRoadError, XRoadStat, XRoadServiceList, XRoadServiceListMember,
                                              XRoadServiceListSubsystem, XRoadServiceListService,
                                              XRoadServiceListSecurityServer, XRoadBatchResult, XRoadDistinctServiceStat,
-                                             XRoadHeartbeat)
-from ckanext.xroad_integration.xroad_utils import xroad_catalog_query_json, ContentFetchError, http
+                                             XRoadHeartbeat, XRoadOrganizationCursor, XRoadErrorRollup)
+from ckanext.xroad_integration.xroad_error_categories import get_error_categories
+from ckanext.xroad_integration.xroad_http import get_session, TRANSPORT_ERRORS
+from ckanext.xroad_integration.xroad_utils import xroad_catalog_query_json, ContentFetchError
 
 
 # PUBLIC_ORGANIZATION_CLASSES = ['GOV', 'MUN', 'ORG']
@@ -27,6 +31,10 @@ from ckanext.xroad_integration.xroad_utils import xroad_catalog_query_json, Cont
 DEFAULT_DAYS_TO_FETCH = 1
 DEFAULT_LIST_ERRORS_HISTORY_IN_DAYS = 90
 DEFAULT_LIST_ERRORS_PAGE_LIMIT = 20
+DEFAULT_ORGANIZATION_FETCH_CONCURRENCY = 4
+DEFAULT_ERROR_LIST_PAGE_SIZE = 100
+MAX_ERROR_LIST_PAGE_SIZE = 1000
+DEFAULT_ERROR_STATS_DAYS = 30
 
 log = logging.getLogger(__name__)
 
@@ -34,65 +42,206 @@ log = logging.getLogger(__name__)
 def update_xroad_organizations(context, data_dict):
     toolkit.check_access('update_xroad_organizations', context)
     harvest_source_list = toolkit.get_action('harvest_source_list')
-    organization_list = toolkit.get_action('organization_list')
-    organization_show = toolkit.get_action('organization_show')
     organization_patch = toolkit.get_action('organization_patch')
+    organization_show = toolkit.get_action('organization_show')
 
     harvest_sources = harvest_source_list(context, {})
-    organization_names = organization_list(context, {})
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-
-    errors_by_source = {}
-
-    updated = 0
+    full = toolkit.asbool(data_dict.get('full', False))
+    started = datetime.datetime.now()
+    timestamp = started.strftime('%Y-%m-%dT%H:%M:%S')
 
+    # Organization data comes from the X-Road catalog regardless of the source,
+    # so organizations are updated once for all sources that allow it
+    applied_sources = []
     for harvest_source in harvest_sources:
         if harvest_source.get('type') != 'xroad':
             continue
 
-        source_config = json.loads(harvest_source.get('config', '{}'))
+        source_config = json.loads(harvest_source.get('config') or '{}')
         source_title = harvest_source.get('title')
 
         if source_config.get('disable_xroad_organization_updates') is True:
             log.info("XRoad organization updates disabled for %s, skipping...", source_title)
             continue
 
-        errors = []
+        applied_sources.append(source_title)
 
-        for organization_name in organization_names:
-            organization = organization_show(context, {'id': organization_name})
+    if not applied_sources:
+        return {'success': True, 'message': 'Updated 0 organizations, 0 unchanged', 'sources': []}
 
-            if not organization.get('xroad_membercode'):
-                continue
+    log.info('Updating X-Road organizations (%s) for sources: %s',
+             'full' if full else 'incremental', ', '.join(applied_sources))
 
-            last_updated = organization.get('metadata_updated_from_xroad_timestamp') or '2011-01-01T00:00:00'
-            try:
-                patch = _prepare_xroad_organization_patch(organization, last_updated)
+    cursors = {} if full else XRoadOrganizationCursor.get_all()
+    checked = {}
+    errors = []
+    updated = 0
+    unchanged = 0
+
+    organizations_by_member_code = _xroad_organizations_by_member_code()
+    concurrency = toolkit.asint(toolkit.config.get('ckanext.xroad_integration.organization_fetch_concurrency',
+                                                   DEFAULT_ORGANIZATION_FETCH_CONCURRENCY))
+
+    # Catalog queries run concurrently, organizations are patched one at a time in this thread.
+    # Queries are submitted as earlier ones complete, so results are not held for all members at once.
+    members = iter(organizations_by_member_code.items())
+    max_pending = 2 * max(1, concurrency)
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        def submit_members():
+            for member_code, organizations in itertools.islice(members, max_pending - len(pending)):
+                future = executor.submit(
+                    _fetch_organization_information, member_code, organizations[0]['name'],
+                    None if full else _organization_last_updated(cursors.get(member_code), organizations))
+                pending[future] = (member_code, organizations)
 
-                if patch is not None:
-                    log.debug('Updating organization %s data from %s', organization_name, source_title)
-                    patch['metadata_updated_from_xroad_timestamp'] = timestamp
-                    try:
-                        organization_patch(context, patch)
-                        updated += 1
-                    except toolkit.ValidationError:
-                        log.debug('Validation error updating %s from %s: %s', organization_name, source_title, pformat(patch))
+        try:
+            submit_members()
+            while pending:
+                for future in as_completed(list(pending)):
+                    member_code, organizations = pending.pop(future)
+                    submit_members()
 
-                else:
-                    log.debug('Nothing to do for %s from %s', organization_name, source_title)
-            except ContentFetchError as cfe:
-                errors.append(', '.join(repr(a) for a in cfe.args))
+                    try:
+                        patch = _prepare_xroad_organization_patch(organizations[0], future.result())
+                    except ContentFetchError as cfe:
+                        errors.append(', '.join(repr(a) for a in cfe.args))
+                        continue
 
-        if errors:
-            errors_by_source[source_title] = list(set(errors))
+                    patched = True
+                    for organization in organizations:
+                        organization_name = organization['name']
+                        if patch is None:
+                            log.debug('Nothing to do for %s', organization_name)
+                            continue
+
+                        current = organization_show(dict(context), {
+                            'id': organization['id'], 'include_datasets': False, 'include_dataset_count': False,
+                            'include_users': False, 'include_groups': False, 'include_tags': False,
+                            'include_followers': False})
+                        changed_fields = _organization_changed_fields(current, patch)
+                        if not changed_fields:
+                            log.debug('Organization %s is up to date', organization_name)
+                            unchanged += 1
+                            continue
+
+                        log.debug('Updating organization %s data: %s', organization_name, ', '.join(changed_fields))
+                        organization_data = dict(patch, id=organization['id'],
+                                                 metadata_updated_from_xroad_timestamp=timestamp)
+                        try:
+                            organization_patch(context, organization_data)
+                            updated += 1
+                        except toolkit.ValidationError:
+                            patched = False
+                            log.debug('Validation error updating %s: %s', organization_name,
+                                      pformat(organization_data))
+
+                    # Members are checked again from the same point on the next run
+                    # unless all their organizations were updated
+                    if patched:
+                        checked[member_code] = started
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    XRoadOrganizationCursor.save_all(checked)
 
-    if errors_by_source:
-        return {'success': False, 'message': json.dumps(errors_by_source)}
+    if errors:
+        # Organizations are updated once for all sources, so their errors are reported once as well
+        return {'success': False, 'message': json.dumps(sorted(set(errors))), 'sources': applied_sources}
     else:
-        return {'success': True, 'message': 'Updated {} organizations'.format(updated)}
+        return {'success': True, 'message': 'Updated {} organizations, {} unchanged'.format(updated, unchanged),
+                'sources': applied_sources}
 
 
-def _prepare_xroad_organization_patch(organization, last_updated):
+def _organization_changed_fields(current, patch):
+    '''Returns the names of fields whose values in the patch differ from the current organization'''
+    changed = []
+    for key, value in patch.items():
+        if key == 'id':
+            continue
+        current_value = current.get(key)
+        if isinstance(value, dict):
+            if _translations_differ(current_value if isinstance(current_value, dict) else {}, value):
+                changed.append(key)
+        elif (current_value or None) != (value or None):
+            changed.append(key)
+    return changed
+
+
+def _translations_differ(current, new):
+    # Validators may fill translations missing from the patch with the default language value
+    default = next((text for text in new.values() if text), '')
+    for language, text in new.items():
+        current_text = current.get(language) or ''
+        if text:
+            if current_text != text:
+                return True
+        elif current_text not in ('', default):
+            return True
+    return False
+
+
+def _organization_last_updated(cursor, organizations):
+    '''Returns the time organizations of a member were last checked, or None if they need a full update
+
+    Members without a cursor fall back to the update timestamps of their organizations.
+    '''
+    if cursor is not None:
+        return cursor.strftime('%Y-%m-%dT%H:%M:%S')
+
+    timestamps = [organization.get('metadata_updated_from_xroad_timestamp') for organization in organizations]
+    return None if not all(timestamps) else min(timestamps)
+
+
+def _xroad_organizations_by_member_code():
+    '''Returns active organizations with an X-Road member code grouped by the member code'''
+    member_code = aliased(model.GroupExtra)
+    updated_timestamp = aliased(model.GroupExtra)
+
+    rows = (model.Session.query(model.Group.id, model.Group.name, member_code.value, updated_timestamp.value)
+            .join(member_code, and_(member_code.group_id == model.Group.id,
+                                    member_code.key == 'xroad_membercode',
+                                    member_code.state == 'active'))
+            .outerjoin(updated_timestamp, and_(updated_timestamp.group_id == model.Group.id,
+                                               updated_timestamp.key == 'metadata_updated_from_xroad_timestamp',
+                                               updated_timestamp.state == 'active'))
+            .filter(model.Group.is_organization == True)  # noqa
+            .filter(model.Group.state == 'active')
+            .filter(member_code.value != '')
+            .order_by(model.Group.name))
+
+    organizations_by_member_code = {}
+    for group_id, name, code, last_updated in rows:
+        organizations_by_member_code.setdefault(code, []).append({
+            'id': group_id,
+            'name': name,
+            'xroad_membercode': code,
+            'metadata_updated_from_xroad_timestamp': last_updated
+        })
+
+    return organizations_by_member_code
+
+
+def _fetch_organization_information(member_code, organization_name, last_updated):
+    '''Queries the catalog for organization information of a member, or None if it has not changed since last_updated
+
+    Called from worker threads, so only performs catalog queries.
+    '''
+    try:
+        if last_updated is None or _get_organization_changes(member_code, last_updated):
+            return _get_organization_information(member_code)
+        else:
+            log.info('No changes to organization %s since last update at %s, skipping...', organization_name, last_updated)
+            return None
+    except Exception:
+        log.warning("Exception while fetching %s (%s)", organization_name, member_code)
+        raise
+
+
+def _prepare_xroad_organization_patch(organization, org_information_list):
     member_code = organization.get('xroad_membercode')
     organization_name = organization.get('name')
 
@@ -103,12 +252,6 @@ def _prepare_xroad_organization_patch(organization, last_updated):
     organization_dict = {'id': organization['id']}
 
     try:
-        if last_updated or _get_organization_changes(member_code, last_updated):
-            org_information_list = _get_organization_information(member_code)
-        else:
-            log.info('No changes to organization %s since last update at %s, skipping...', organization_name, last_updated)
-            return None
-
         if not org_information_list:
             return None
         else:
@@ -284,7 +427,7 @@ def _get_organization_information(business_code):
             return organization_json
         else:
             return None
-    except ConnectionError:
+    except TRANSPORT_ERRORS:
         log.error("Calling XRoad service getOrganization failed")
         raise ContentFetchError("Calling XRoad service getOrganization failed")
 
@@ -300,9 +443,13 @@ def _get_organization_changes(business_code, changed_after):
 
         organization_changes = xroad_catalog_query_json('getOrganizationChanges',
                                                         params=[business_code], queryparams=queryparams)
+        if organization_changes is None:
+            # Without an answer the organization is considered changed
+            return True
+
         return organization_changes.get('changed')
 
-    except ConnectionError:
+    except TRANSPORT_ERRORS:
         log.error("Calling XRoad service getOrganizationChanges failed")
         raise ContentFetchError("Calling XRoad service getOrganizationChanges failed")
 
@@ -424,12 +571,12 @@ def fetch_xroad_errors(context, data_dict):
                     except ValueError:
                         return {'success': False, 'message': 'Calling listErrors failed!'}
 
-                except ConnectionError as e:
+                except TRANSPORT_ERRORS as e:
                     log.warning("Calling listErrors failed!")
                     log.info(e)
                     return {"success": False, "message": "Fetching errors failed."}
 
-    except ConnectionError as e:
+    except TRANSPORT_ERRORS as e:
         log.warning("Calling listErrors failed!")
         log.info(e)
         return {"success": False, "message": "Fetching errors failed."}
@@ -444,7 +591,6 @@ def fetch_xroad_errors(context, data_dict):
 
 def _fetch_error_page(params, queryparams, pagination) -> (int, int):
 
-    error_count = 0
     error_data = xroad_catalog_query_json('listErrors',
                                           params=params,
                                           queryparams=queryparams,
@@ -455,8 +601,9 @@ def _fetch_error_page(params, queryparams, pagination) -> (int, int):
 
     error_log_list = error_data.get('errorLogList', [])
 
+    mapped_errors = []
     for error in error_log_list:
-        mapped_error = {
+        mapped_errors.append({
             "message": error.get('message', ''),
             "code": error.get('code', ''),
             "created": parse_xroad_catalog_datetime(error['created']),
@@ -469,9 +616,10 @@ def _fetch_error_page(params, queryparams, pagination) -> (int, int):
             "server_code": error.get('serverCode', ''),
             "security_category_code": error.get('securityCategoryCode', ''),
             "group_code": error.get('groupCode', ''),
-        }
-        XRoadError.create(**mapped_error)
-        error_count = error_count + 1
+        })
+
+    # Errors stored by an earlier fetch of the same window are skipped
+    error_count = XRoadError.create_many(mapped_errors)
 
     return error_data.get('numberOfPages', 0), error_count
 
@@ -497,7 +645,7 @@ def fetch_xroad_service_list(context, data_dict):
 
     try:
         service_list_data = xroad_catalog_query_json('getListOfServices', queryparams=queryparams)
-    except ConnectionError as e:
+    except TRANSPORT_ERRORS as e:
         log.warning("Connection error calling getListOfServices")
         log.info(e)
         return {'success': False, 'message': 'Connection error calling getListOfServices'}
@@ -645,6 +793,11 @@ def parse_xroad_catalog_datetime(dt):
 
 
 def xroad_error_list(context, data_dict):
+    '''Returns a page of errors created on a date, optionally of a single organization and category
+
+    Pages are ordered by (created, id) and selected with the `after` or `before` tokens returned as
+    `next_page` and `previous_page`. Counts of all errors of the date by category are included.
+    '''
     toolkit.check_access('xroad_error_list', context, data_dict)
 
     date = data_dict.get('date')
@@ -653,22 +806,29 @@ def xroad_error_list(context, data_dict):
     else:
         start = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
-    end = start.replace(hour=23, minute=59, second=59)
+    # Half-open range covering the whole day, same as the rollup counts of the date
+    end = start + datetime.timedelta(days=1)
 
-    rest_services_failed_errors = model.Session.query(XRoadError) \
-        .filter(XRoadError.message.like("Fetch of REST services failed%")) \
-        .filter(and_(XRoadError.created >= start), (XRoadError.created <= end))
+    category_names = get_error_categories().names
+    category = data_dict.get('category') or None
+    if category is not None and category not in category_names:
+        raise toolkit.ValidationError(toolkit._(u"Unknown error category"))
 
-    other_errors = model.Session.query(XRoadError) \
-        .filter(not_(XRoadError.message.like("Fetch of REST services failed%"))) \
-        .filter(and_(XRoadError.created >= start), (XRoadError.created <= end))
+    try:
+        limit = data_dict.get('limit')
+        if limit is None or limit == '':
+            limit = toolkit.config.get('ckanext.xroad_integration.error_list_page_size', DEFAULT_ERROR_LIST_PAGE_SIZE)
+        limit = toolkit.asint(limit)
+    except ValueError:
+        limit = None
+    if limit is None or not 1 <= limit <= MAX_ERROR_LIST_PAGE_SIZE:
+        raise toolkit.ValidationError(toolkit._(u"Limit must be between 1 and {}").format(MAX_ERROR_LIST_PAGE_SIZE))
 
-    list_errors = model.Session.query(XRoadError) \
-        .filter(and_(XRoadError.created >= start), (XRoadError.created <= end))
+    after = _parse_error_page_token(data_dict.get('after'))
+    before = _parse_error_page_token(data_dict.get('before'))
 
-    page = 0
-    if "page" in data_dict and data_dict.get('page') is not None:
-        page = int(data_dict.get('page'))
+    criteria = [XRoadError.created >= start, XRoadError.created < end]
+    member = None
 
     organization_id = data_dict.get('organization')
     if organization_id:
@@ -680,42 +840,113 @@ def xroad_error_list(context, data_dict):
         data_dict['organization'] = organization_id
         xroad_id = organization_id.split('.')
         if len(xroad_id) == 3:  # Valid xroad id
-            rest_services_failed_errors = rest_services_failed_errors.filter(XRoadError.xroad_instance == xroad_id[0]) \
-                .filter(XRoadError.member_class == xroad_id[1]) \
-                .filter(XRoadError.member_code == xroad_id[2])
-
-            other_errors = other_errors.filter(XRoadError.xroad_instance == xroad_id[0]) \
-                .filter(XRoadError.member_class == xroad_id[1]) \
-                .filter(XRoadError.member_code == xroad_id[2])
-
-            list_errors = list_errors.filter(XRoadError.xroad_instance == xroad_id[0]) \
-                .filter(XRoadError.member_class == xroad_id[1]) \
-                .filter(XRoadError.member_code == xroad_id[2])
-
+            member = tuple(xroad_id)
+            criteria += [XRoadError.xroad_instance == xroad_id[0],
+                         XRoadError.member_class == xroad_id[1],
+                         XRoadError.member_code == xroad_id[2]]
         else:
             raise toolkit.ValidationError(toolkit._(u"Organization id is not valid X-Road id"))
 
-    rest_services_failed_errors = rest_services_failed_errors.all()
-    other_errors = other_errors.all()
-    list_errors = list_errors.all()
-
-    max_pages = 1
-    if len(list_errors) > DEFAULT_LIST_ERRORS_PAGE_LIMIT:
-        max_pages = int(len(list_errors) / DEFAULT_LIST_ERRORS_PAGE_LIMIT)
-    previous_page = (page - 1) if (page > 0) else 0
-    next_page = (page + 1) if (page < max_pages) else max_pages
-    page += 1
+    # Counts of the day come from the daily error rollup instead of the errors themselves
+    counts = {c: 0 for c in category_names}
+    counts.update((category, int(count)) for category, count
+                  in XRoadErrorRollup.get_counts(start.date(), start.date(), ['category'], member=member))
+
+    errors = model.Session.query(XRoadError).filter(*criteria)
+    if category is not None:
+        errors = errors.filter(XRoadError.category == category)
+
+    key = tuple_(XRoadError.created, XRoadError.id)
+    if before is not None:
+        page = (errors.filter(key < before)
+                .order_by(XRoadError.created.desc(), XRoadError.id.desc())
+                .limit(limit + 1)
+                .all())
+        # Errors following the page were not part of the query, the error of the token itself may be gone
+        has_previous = len(page) > limit
+        has_next = model.Session.query(errors.filter(key >= before).exists()).scalar()
+        page = list(reversed(page[:limit]))
+    else:
+        if after is not None:
+            errors = errors.filter(key > after)
+        page = (errors.order_by(XRoadError.created.asc(), XRoadError.id.asc())
+                .limit(limit + 1)
+                .all())
+        has_previous, has_next = after is not None, len(page) > limit
+        page = page[:limit]
 
     return {
-        "rest_services_failed_errors": [error.as_dict() for error in rest_services_failed_errors],
-        "list_errors": [error.as_dict() for error in list_errors],
-        "other_errors": [error.as_dict() for error in other_errors],
+        "list_errors": [error.as_dict() for error in page],
+        "category": category,
+        "counts": counts,
+        "total": sum(counts.values()),
         "date": start.isoformat(),
         "previous": (start - relativedelta.relativedelta(days=1)).date().strftime("%Y-%m-%d"),
         "next": (start + relativedelta.relativedelta(days=1)).date().strftime("%Y-%m-%d"),
         "organization": organization_id,
-        "previous_page": previous_page,
-        "next_page": next_page
+        "previous_page": _error_page_token(page[0]) if page and has_previous else None,
+        "next_page": _error_page_token(page[-1]) if page and has_next else None
+    }
+
+
+def _error_page_token(error):
+    return '{}_{}'.format(error.created.isoformat(), error.id)
+
+
+def _parse_error_page_token(token):
+    if not token:
+        return None
+
+    try:
+        created, error_id = token.split('_', 1)
+        return datetime.datetime.fromisoformat(created), error_id
+    except ValueError:
+        raise toolkit.ValidationError(toolkit._(u"Invalid page"))
+
+
+def xroad_error_stats(context, data_dict):
+    '''Returns numbers of errors between start_date and end_date per day, or per the columns in group_by
+
+    Counts come from the daily error rollup. With organization, only errors of that X-Road member are counted.
+    '''
+    toolkit.check_access('xroad_error_stats', context, data_dict)
+
+    try:
+        end_date = string_to_date(data_dict.get('end_date')) or datetime.datetime.now()
+        start_date = (string_to_date(data_dict.get('start_date')) or
+                      end_date - relativedelta.relativedelta(days=DEFAULT_ERROR_STATS_DAYS - 1))
+    except ValueError:
+        raise toolkit.ValidationError(toolkit._(u"Dates must be given as YYYY-MM-DD"))
+
+    if start_date > end_date:
+        raise toolkit.ValidationError(toolkit._(u"Start date cannot be later than end date"))
+
+    group_by = [column.strip() for column in toolkit.aslist(data_dict.get('group_by') or 'day', ',')]
+    if not group_by or any(column not in XRoadErrorRollup.KEY_COLUMNS for column in group_by):
+        raise toolkit.ValidationError(toolkit._(u"Errors can be grouped by: {}").format(
+            ', '.join(XRoadErrorRollup.KEY_COLUMNS)))
+
+    member = None
+    organization_id = data_dict.get('organization')
+    if organization_id:
+        member = tuple(organization_id.split('.'))
+        if len(member) != 3:
+            raise toolkit.ValidationError(toolkit._(u"Organization id is not valid X-Road id"))
+
+    stats = []
+    for row in XRoadErrorRollup.get_counts(start_date.date(), end_date.date(), group_by, member=member):
+        stat = dict(zip(group_by + ['count'], row))
+        if 'day' in stat:
+            stat['day'] = stat['day'].isoformat()
+        stat['count'] = int(stat['count'])
+        stats.append(stat)
+
+    return {
+        'success': True,
+        'start_date': date_to_string(start_date),
+        'end_date': date_to_string(end_date),
+        'organization': organization_id,
+        'stats': stats
     }
 
 
@@ -767,7 +998,7 @@ def fetch_xroad_stats(context, data_dict):
         return {"success": True, "message": "Statistics from %s to %s stored in database." %
                 (queryparams['startDate'], queryparams['endDate'])}
 
-    except ConnectionError as e:
+    except TRANSPORT_ERRORS as e:
         log.warn("Calling getServiceStatistics failed!")
         log.info(e)
         return {"success": False, "message": "Fetching statistics failed."}
@@ -818,7 +1049,7 @@ def fetch_distinct_service_stats(context, data_dict):
         return {"success": True, "message": "Distinct service statistics from %s to %s stored in database."
                                             % (queryparams['startDate'], queryparams['endDate'])}
 
-    except ConnectionError as e:
+    except TRANSPORT_ERRORS as e:
         log.warn("Calling getDistinctServiceStatistics failed!")
         log.info(e)
         return {"success": False, "message": "Fetching distinct service statistics failed."}
@@ -902,7 +1133,7 @@ def fetch_xroad_heartbeat(context, data_dict):
         certificate_args['cert'] = xroad_client_certificate
 
     try:
-        response = http.get(url, headers=headers, **certificate_args)
+        response = get_session().get(url, headers=headers, endpoint=service, **certificate_args)
         result = response.status_code == 200
     except Exception:
         result = False
@@ -0,0 +1,111 @@
+"""Create remaining xroad tables
+
+Revision ID: 2a9f6c3e8d17
+Revises: c4e7a91d2f35
+Create Date: 2026-10-18 14:22:53.904117
+
+"""
+import uuid
+
+import six
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a9f6c3e8d17'
+down_revision = 'c4e7a91d2f35'
+branch_labels = None
+depends_on = None
+
+TABLES = ['xroad_stats', 'xroad_distinct_service_stats', 'xroad_service_lists', 'xroad_service_list_security_servers',
+          'xroad_service_list_members', 'xroad_service_list_subsystems', 'xroad_service_list_services',
+          'xroad_batch_results', 'xroad_heartbeat']
+
+
+def make_uuid():
+    return six.text_type(uuid.uuid4())
+
+
+def upgrade():
+    # Installations set up with `ckan xroad init-db` already have some or all of these tables
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'xroad_stats' not in existing:
+        op.create_table('xroad_stats',
+                        sa.Column('id', sa.types.UnicodeText, primary_key=True, default=make_uuid),
+                        sa.Column('date', sa.types.DateTime, nullable=False),
+                        sa.Column('soap_service_count', sa.types.Integer, nullable=False),
+                        sa.Column('rest_service_count', sa.types.Integer, nullable=False),
+                        sa.Column('openapi_service_count', sa.types.Integer, nullable=False))
+
+    if 'xroad_distinct_service_stats' not in existing:
+        op.create_table('xroad_distinct_service_stats',
+                        sa.Column('id', sa.types.UnicodeText, primary_key=True, default=make_uuid),
+                        sa.Column('date', sa.types.DateTime, nullable=False),
+                        sa.Column('distinct_service_count', sa.types.Integer, nullable=False))
+
+    if 'xroad_service_lists' not in existing:
+        op.create_table('xroad_service_lists',
+                        sa.Column('id', sa.types.Integer, primary_key=True),
+                        sa.Column('timestamp', sa.types.DateTime, nullable=False))
+
+    if 'xroad_service_list_security_servers' not in existing:
+        op.create_table('xroad_service_list_security_servers',
+                        sa.Column('id', sa.types.Integer, primary_key=True),
+                        sa.Column('xroad_service_list_id', sa.types.Integer, sa.ForeignKey('xroad_service_lists.id'),
+                                  nullable=False),
+                        sa.Column('instance', sa.types.Unicode, nullable=False),
+                        sa.Column('member_class', sa.types.Unicode, nullable=False),
+                        sa.Column('member_code', sa.types.Unicode, nullable=False),
+                        sa.Column('server_code', sa.types.Unicode, nullable=False),
+                        sa.Column('address', sa.types.Unicode, nullable=False))
+
+    if 'xroad_service_list_members' not in existing:
+        op.create_table('xroad_service_list_members',
+                        sa.Column('id', sa.types.Integer, primary_key=True),
+                        sa.Column('xroad_service_list_id', sa.types.Integer, sa.ForeignKey('xroad_service_lists.id'),
+                                  nullable=False),
+                        sa.Column('created', sa.types.DateTime, nullable=False),
+                        sa.Column('instance', sa.types.Unicode, nullable=False),
+                        sa.Column('member_class', sa.types.Unicode, nullable=False),
+                        sa.Column('member_code', sa.types.Unicode, nullable=False),
+                        sa.Column('name', sa.types.Unicode, nullable=False),
+                        sa.Column('is_provider', sa.types.Boolean, nullable=False))
+
+    if 'xroad_service_list_subsystems' not in existing:
+        op.create_table('xroad_service_list_subsystems',
+                        sa.Column('id', sa.types.Integer, primary_key=True),
+                        sa.Column('xroad_service_list_member_id', sa.types.Integer,
+                                  sa.ForeignKey('xroad_service_list_members.id'), nullable=False),
+                        sa.Column('created', sa.types.DateTime, nullable=False),
+                        sa.Column('subsystem_code', sa.types.Unicode, nullable=False))
+
+    if 'xroad_service_list_services' not in existing:
+        op.create_table('xroad_service_list_services',
+                        sa.Column('id', sa.types.Integer, primary_key=True),
+                        sa.Column('xroad_service_list_subsystem_id', sa.types.Integer,
+                                  sa.ForeignKey('xroad_service_list_subsystems.id'), nullable=False),
+                        sa.Column('created', sa.types.DateTime, nullable=False),
+                        sa.Column('service_code', sa.types.Unicode, nullable=False),
+                        sa.Column('service_version', sa.types.Unicode, nullable=True),
+                        sa.Column('active', sa.types.Boolean, nullable=False, default=True))
+
+    if 'xroad_batch_results' not in existing:
+        op.create_table('xroad_batch_results',
+                        sa.Column('id', sa.types.UnicodeText, primary_key=True, default=make_uuid),
+                        sa.Column('service', sa.types.UnicodeText, nullable=False),
+                        sa.Column('success', sa.types.Boolean, nullable=False),
+                        sa.Column('timestamp', sa.types.DateTime, server_default=sa.func.now()),
+                        sa.Column('params', sa.types.UnicodeText, nullable=True),
+                        sa.Column('message', sa.types.UnicodeText, nullable=True))
+
+    if 'xroad_heartbeat' not in existing:
+        op.create_table('xroad_heartbeat',
+                        sa.Column('timestamp', sa.types.DateTime, primary_key=True, server_default=sa.func.now()),
+                        sa.Column('success', sa.types.Boolean, nullable=False))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_table(table)
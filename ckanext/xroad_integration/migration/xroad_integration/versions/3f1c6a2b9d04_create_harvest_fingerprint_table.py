@@ -0,0 +1,31 @@
+"""Create harvest fingerprint table
+
+Revision ID: 3f1c6a2b9d04
+Revises: 7d4070e62886
+Create Date: 2026-10-18 09:12:41.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c6a2b9d04'
+down_revision = '7d4070e62886'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may already have been created by `ckan xroad init-db`
+    if sa.inspect(op.get_bind()).has_table('xroad_harvest_fingerprints'):
+        return
+
+    op.create_table('xroad_harvest_fingerprints',
+                    sa.Column('guid', sa.types.UnicodeText, primary_key=True),
+                    sa.Column('fingerprint', sa.types.UnicodeText, nullable=False),
+                    sa.Column('updated', sa.types.DateTime, nullable=False, server_default=sa.func.now()))
+
+
+def downgrade():
+    op.drop_table('xroad_harvest_fingerprints')
@@ -0,0 +1,61 @@
+"""Add indexes and unique stats dates to xroad tables
+
+Revision ID: 5d3b8e1f0a64
+Revises: 2a9f6c3e8d17
+Create Date: 2026-10-18 14:37:18.250663
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d3b8e1f0a64'
+down_revision = '2a9f6c3e8d17'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('xroad_errors_member_created_idx', 'xroad_errors', ['xroad_instance', 'member_class', 'member_code', 'created']),
+    ('ix_xroad_service_lists_timestamp', 'xroad_service_lists', ['timestamp']),
+    ('ix_xroad_service_list_security_servers_xroad_service_list_id', 'xroad_service_list_security_servers',
+     ['xroad_service_list_id']),
+    ('ix_xroad_service_list_members_xroad_service_list_id', 'xroad_service_list_members', ['xroad_service_list_id']),
+    ('ix_xroad_service_list_subsystems_xroad_service_list_member_id', 'xroad_service_list_subsystems',
+     ['xroad_service_list_member_id']),
+    ('ix_xroad_service_list_services_xroad_service_list_subsystem_id', 'xroad_service_list_services',
+     ['xroad_service_list_subsystem_id']),
+    ('xroad_batch_results_service_timestamp_idx', 'xroad_batch_results', ['service', 'timestamp']),
+]
+
+UNIQUE_DATES = [
+    ('xroad_stats_date_key', 'xroad_stats'),
+    ('xroad_distinct_service_stats_date_key', 'xroad_distinct_service_stats'),
+]
+
+
+def upgrade():
+    # Tables created with `ckan xroad init-db` may already have these
+    inspector = sa.inspect(op.get_bind())
+
+    for name, table, columns in INDEXES:
+        if name not in [index['name'] for index in inspector.get_indexes(table)]:
+            op.create_index(name, table, columns)
+
+    for name, table in UNIQUE_DATES:
+        if name in [constraint['name'] for constraint in inspector.get_unique_constraints(table)]:
+            continue
+
+        # Keep one of the stats stored more than once for the same date
+        op.execute("DELETE FROM {table} WHERE id IN ("
+                   "SELECT id FROM (SELECT id, row_number() OVER (PARTITION BY date ORDER BY id) AS n FROM {table}) s "
+                   "WHERE s.n > 1)".format(table=table))
+        op.create_unique_constraint(name, table, ['date'])
+
+
+def downgrade():
+    for name, table in UNIQUE_DATES:
+        op.drop_constraint(name, table, type_='unique')
+
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table)
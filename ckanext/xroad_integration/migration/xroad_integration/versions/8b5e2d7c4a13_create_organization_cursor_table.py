@@ -0,0 +1,30 @@
+"""Create organization cursor table
+
+Revision ID: 8b5e2d7c4a13
+Revises: 3f1c6a2b9d04
+Create Date: 2026-10-18 14:03:27.204611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5e2d7c4a13'
+down_revision = '3f1c6a2b9d04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may already have been created by `ckan xroad init-db`
+    if sa.inspect(op.get_bind()).has_table('xroad_organization_cursors'):
+        return
+
+    op.create_table('xroad_organization_cursors',
+                    sa.Column('member_code', sa.types.UnicodeText, primary_key=True),
+                    sa.Column('checked', sa.types.DateTime, nullable=False))
+
+
+def downgrade():
+    op.drop_table('xroad_organization_cursors')
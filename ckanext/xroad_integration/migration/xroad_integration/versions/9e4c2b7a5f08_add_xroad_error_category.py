@@ -0,0 +1,37 @@
+"""Add category to xroad errors
+
+Revision ID: 9e4c2b7a5f08
+Revises: 5d3b8e1f0a64
+Create Date: 2026-10-18 15:54:30.617482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4c2b7a5f08'
+down_revision = '5d3b8e1f0a64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    # The column and index may already have been created by `ckan xroad init-db`
+    if 'category' in [column['name'] for column in inspector.get_columns('xroad_errors')]:
+        return
+
+    op.add_column('xroad_errors', sa.Column('category', sa.types.UnicodeText, nullable=False, server_default='other'))
+
+    # Default categories, errors matching configured categories are updated with `ckan xroad categorize-errors`
+    op.execute("UPDATE xroad_errors SET category = 'rest_services_failed' "
+               "WHERE message LIKE 'Fetch of REST services failed%'")
+
+    op.create_index('xroad_errors_category_created_idx', 'xroad_errors', ['category', 'created'])
+
+
+def downgrade():
+    op.drop_index('xroad_errors_category_created_idx', 'xroad_errors')
+    op.drop_column('xroad_errors', 'category')
@@ -0,0 +1,47 @@
+"""Create error rollup table
+
+Revision ID: b6d1f4a8c3e2
+Revises: 9e4c2b7a5f08
+Create Date: 2026-10-18 17:08:45.120394
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1f4a8c3e2'
+down_revision = '9e4c2b7a5f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table may already have been created by `ckan xroad init-db`
+    if sa.inspect(op.get_bind()).has_table('xroad_error_rollups'):
+        return
+
+    op.create_table('xroad_error_rollups',
+                    sa.Column('day', sa.types.Date, primary_key=True),
+                    sa.Column('xroad_instance', sa.types.UnicodeText, primary_key=True),
+                    sa.Column('member_class', sa.types.UnicodeText, primary_key=True),
+                    sa.Column('member_code', sa.types.UnicodeText, primary_key=True),
+                    sa.Column('subsystem_code', sa.types.UnicodeText, primary_key=True),
+                    sa.Column('service_code', sa.types.UnicodeText, primary_key=True),
+                    sa.Column('category', sa.types.UnicodeText, primary_key=True),
+                    sa.Column('code', sa.types.Integer, primary_key=True),
+                    sa.Column('count', sa.types.Integer, nullable=False))
+    op.create_index('xroad_error_rollups_member_day_idx', 'xroad_error_rollups',
+                    ['xroad_instance', 'member_class', 'member_code', 'day'])
+
+    # Count errors stored so far, same as `ckan xroad rebuild-error-stats`
+    op.execute("INSERT INTO xroad_error_rollups "
+               "SELECT CAST(created AS DATE), coalesce(xroad_instance, ''), coalesce(member_class, ''), "
+               "coalesce(member_code, ''), coalesce(subsystem_code, ''), coalesce(service_code, ''), category, code, "
+               "count(*) "
+               "FROM xroad_errors WHERE created IS NOT NULL "
+               "GROUP BY 1, 2, 3, 4, 5, 6, 7, 8")
+
+
+def downgrade():
+    op.drop_table('xroad_error_rollups')
@@ -0,0 +1,50 @@
+"""Add natural key to xroad errors
+
+Revision ID: c4e7a91d2f35
+Revises: 8b5e2d7c4a13
+Create Date: 2026-10-18 13:41:07.281904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a91d2f35'
+down_revision = '8b5e2d7c4a13'
+branch_labels = None
+depends_on = None
+
+# NULLs never conflict in a unique constraint, so missing values of these columns are stored empty
+NATURAL_KEY_TEXT_COLUMNS = ['xroad_instance', 'member_class', 'member_code', 'subsystem_code', 'service_code']
+NATURAL_KEY = ['created', 'xroad_instance', 'member_class', 'member_code', 'subsystem_code', 'service_code', 'code',
+               'message_hash']
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    # The column and constraint may already have been created by `ckan xroad init-db`
+    if 'message_hash' in [column['name'] for column in inspector.get_columns('xroad_errors')]:
+        return
+
+    op.add_column('xroad_errors', sa.Column('message_hash', sa.types.UnicodeText))
+    op.execute("UPDATE xroad_errors SET message_hash = md5(message)")
+
+    for column in NATURAL_KEY_TEXT_COLUMNS:
+        op.execute("UPDATE xroad_errors SET {0} = COALESCE({0}, '')".format(column))
+        op.alter_column('xroad_errors', column, nullable=False, server_default='')
+
+    # Keep one of each set of errors stored more than once by earlier fetches of the same window
+    op.execute("DELETE FROM xroad_errors WHERE id IN ("
+               "SELECT id FROM (SELECT id, row_number() OVER (PARTITION BY {} ORDER BY id) AS n FROM xroad_errors) e "
+               "WHERE e.n > 1)".format(', '.join(NATURAL_KEY)))
+
+    op.create_unique_constraint('xroad_errors_natural_key', 'xroad_errors', NATURAL_KEY)
+
+
+def downgrade():
+    op.drop_constraint('xroad_errors_natural_key', 'xroad_errors', type_='unique')
+    op.drop_column('xroad_errors', 'message_hash')
+    for column in NATURAL_KEY_TEXT_COLUMNS:
+        op.alter_column('xroad_errors', column, nullable=True, server_default=None)
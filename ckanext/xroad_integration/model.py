@@ -1,13 +1,21 @@
+import datetime
+import hashlib
 import uuid
 import logging
 import six
 
 from ckan import model
 from ckan.lib import dictization
-from sqlalchemy import Column, ForeignKey, types, and_
+from collections import Counter
+
+from sqlalchemy import (Column, ForeignKey, Index, UniqueConstraint, types, and_, case, cast, literal_column, select,
+                        true, update)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
+from ckanext.xroad_integration.xroad_error_categories import DEFAULT_CATEGORY, get_error_categories
+
 Base = declarative_base()
 log = logging.getLogger(__name__)
 
@@ -27,31 +35,95 @@ class AsDictMixin:
 class XRoadError(Base, AsDictMixin):
 
     __tablename__ = 'xroad_errors'
+    __table_args__ = (
+        # Errors listed again by the catalog are recognized by their natural key and stored only once
+        UniqueConstraint('created', 'xroad_instance', 'member_class', 'member_code', 'subsystem_code',
+                         'service_code', 'code', 'message_hash', name='xroad_errors_natural_key'),
+        # Errors of an organization within a time range, the natural key covers ranges over all errors
+        Index('xroad_errors_member_created_idx', 'xroad_instance', 'member_class', 'member_code', 'created'),
+        Index('xroad_errors_category_created_idx', 'category', 'created'),
+    )
 
     id = Column(types.UnicodeText, primary_key=True, default=make_uuid)
     message = Column(types.UnicodeText, nullable=False)
     code = Column(types.Integer, nullable=False)
     created = Column(types.DateTime)
-    xroad_instance = Column(types.UnicodeText)
-    member_class = Column(types.UnicodeText)
-    member_code = Column(types.UnicodeText)
-    subsystem_code = Column(types.UnicodeText)
-    service_code = Column(types.UnicodeText)
+    xroad_instance = Column(types.UnicodeText, nullable=False, server_default='')
+    member_class = Column(types.UnicodeText, nullable=False, server_default='')
+    member_code = Column(types.UnicodeText, nullable=False, server_default='')
+    subsystem_code = Column(types.UnicodeText, nullable=False, server_default='')
+    service_code = Column(types.UnicodeText, nullable=False, server_default='')
     service_version = Column(types.UnicodeText)
     server_code = Column(types.UnicodeText)
     security_category_code = Column(types.UnicodeText)
     group_code = Column(types.UnicodeText)
+    message_hash = Column(types.UnicodeText)
+    category = Column(types.UnicodeText, nullable=False, server_default=DEFAULT_CATEGORY)
+
+    # Natural key columns missing from an error are stored empty, as NULLs never conflict in the unique constraint
+    NATURAL_KEY_TEXT_COLUMNS = ['xroad_instance', 'member_class', 'member_code', 'subsystem_code', 'service_code']
+
+    @staticmethod
+    def hash_message(message):
+        # Same as md5() in PostgreSQL, which is used to hash existing messages in migrations
+        return hashlib.md5(message.encode('utf-8')).hexdigest()
 
     @classmethod
     def create(cls, message, code, created, xroad_instance, member_class, member_code, subsystem_code,
                service_code, service_version, server_code, security_category_code, group_code):
 
-        xroad_error = XRoadError(message=message, code=code, created=created, xroad_instance=xroad_instance,
-                                 member_class=member_class, member_code=member_code, subsystem_code=subsystem_code,
-                                 service_code=service_code, service_version=service_version, server_code=server_code,
-                                 security_category_code=security_category_code, group_code=group_code)
-        model.Session.add(xroad_error)
+        cls.create_many([dict(message=message, code=code, created=created, xroad_instance=xroad_instance,
+                              member_class=member_class, member_code=member_code, subsystem_code=subsystem_code,
+                              service_code=service_code, service_version=service_version, server_code=server_code,
+                              security_category_code=security_category_code, group_code=group_code)])
+
+    @classmethod
+    def create_many(cls, errors):
+        '''Stores errors with a single insert, skipping errors already stored. Returns the number of stored errors'''
+        if not errors:
+            return 0
+
+        categories = get_error_categories()
+        rows = []
+        for error in errors:
+            row = dict(error, message=error.get('message') or '')
+            row.update((column, error.get(column) or '') for column in cls.NATURAL_KEY_TEXT_COLUMNS)
+            row.update(id=make_uuid(), message_hash=cls.hash_message(row['message']),
+                       category=error.get('category') or categories.categorize(row['message'], row['code']))
+            rows.append(row)
+        statement = (insert(cls.__table__).values(rows)
+                     .on_conflict_do_nothing(constraint='xroad_errors_natural_key')
+                     .returning(*[getattr(cls, column) for column in XRoadErrorRollup.ERROR_COLUMNS]))
+        stored = model.Session.execute(statement).fetchall()
+        XRoadErrorRollup.add(stored)
         model.repo.commit()
+        return len(stored)
+
+    @classmethod
+    def recategorize(cls, categories):
+        '''Updates categories of stored errors to match the rules of categories, returns the number of changed errors
+
+        Days of the changed errors are recounted in the daily error rollup in the same transaction.
+        '''
+        category = case(*[(cls._matches(rule), rule.category) for rule in categories.rules], else_=DEFAULT_CATEGORY)
+        changed = model.Session.execute(update(cls.__table__).where(cls.category != category).values(category=category)
+                                        .returning(cls.created)).fetchall()
+
+        days = [created.date() for created, in changed if created is not None]
+        if days:
+            XRoadErrorRollup.recount(min(days), max(days))
+
+        model.repo.commit()
+        return len(changed)
+
+    @classmethod
+    def _matches(cls, rule):
+        criteria = []
+        if rule.prefix is not None:
+            criteria.append(cls.message.startswith(rule.prefix, autoescape=True))
+        if rule.code is not None:
+            criteria.append(cls.code == rule.code)
+        return and_(*criteria) if criteria else true()
 
     @classmethod
     def get_last_date(cls):
@@ -62,9 +134,93 @@ class XRoadError(Base, AsDictMixin):
             return None
 
 
+class XRoadErrorRollup(Base, AsDictMixin):
+    '''Number of stored errors per day, service, category and code'''
+    __tablename__ = 'xroad_error_rollups'
+    __table_args__ = (
+        Index('xroad_error_rollups_member_day_idx', 'xroad_instance', 'member_class', 'member_code', 'day'),
+    )
+
+    day = Column(types.Date, primary_key=True)
+    xroad_instance = Column(types.UnicodeText, primary_key=True)
+    member_class = Column(types.UnicodeText, primary_key=True)
+    member_code = Column(types.UnicodeText, primary_key=True)
+    subsystem_code = Column(types.UnicodeText, primary_key=True)
+    service_code = Column(types.UnicodeText, primary_key=True)
+    category = Column(types.UnicodeText, primary_key=True)
+    code = Column(types.Integer, primary_key=True)
+    count = Column(types.Integer, nullable=False)
+
+    KEY_COLUMNS = ['day', 'xroad_instance', 'member_class', 'member_code', 'subsystem_code', 'service_code',
+                   'category', 'code']
+    # Columns of stored errors the key is derived from, in the same order
+    ERROR_COLUMNS = ['created', 'xroad_instance', 'member_class', 'member_code', 'subsystem_code', 'service_code',
+                     'category', 'code']
+
+    @classmethod
+    def add(cls, errors):
+        '''Adds errors given as ERROR_COLUMNS rows to the counts, committed by the caller'''
+        counts = Counter((created.date(),) + tuple(value or '' for value in values) + (code,)
+                         for created, *values, code in errors if created is not None)
+        if not counts:
+            return
+
+        rows = [dict(zip(cls.KEY_COLUMNS, key), count=count) for key, count in counts.items()]
+        statement = insert(cls.__table__).values(rows)
+        model.Session.execute(statement.on_conflict_do_update(
+            index_elements=cls.KEY_COLUMNS, set_={'count': cls.__table__.c.count + statement.excluded.count}))
+
+    @classmethod
+    def rebuild(cls, start=None, end=None):
+        '''Recounts days from start to end from stored errors, or all days if not given'''
+        cls.recount(start, end)
+        model.repo.commit()
+
+    @classmethod
+    def recount(cls, start=None, end=None):
+        '''Recounts days like `rebuild` without committing, to be part of a larger transaction'''
+        criteria = [XRoadError.created.isnot(None)]
+        if start is not None:
+            criteria.append(XRoadError.created >= datetime.datetime.combine(start, datetime.time.min))
+        if end is not None:
+            criteria.append(XRoadError.created < datetime.datetime.combine(end + datetime.timedelta(days=1),
+                                                                           datetime.time.min))
+
+        deleted = model.Session.query(cls)
+        if start is not None:
+            deleted = deleted.filter(cls.day >= start)
+        if end is not None:
+            deleted = deleted.filter(cls.day <= end)
+        deleted.delete(synchronize_session=False)
+
+        keys = ([cast(XRoadError.created, types.Date)] +
+                [func.coalesce(getattr(XRoadError, column), literal_column("''")) for column in cls.ERROR_COLUMNS[1:-1]] +
+                [XRoadError.code])
+        counts = select(*keys, func.count()).where(*criteria).group_by(*keys)
+        model.Session.execute(insert(cls.__table__).from_select(cls.KEY_COLUMNS + ['count'], counts))
+
+    @classmethod
+    def get_counts(cls, start, end, group_by, member=None):
+        '''Returns error counts between start and end days grouped by the given key columns
+
+        Counts can be limited to a member given as an (instance, member class, member code) tuple.
+        '''
+        keys = [getattr(cls, column) for column in group_by]
+        query = (model.Session.query(*keys, func.sum(cls.count).label('count'))
+                 .filter(cls.day >= start, cls.day <= end))
+        if member is not None:
+            xroad_instance, member_class, member_code = member
+            query = query.filter(cls.xroad_instance == xroad_instance, cls.member_class == member_class,
+                                 cls.member_code == member_code)
+        return query.group_by(*keys).order_by(*keys).all()
+
+
 class XRoadStat(Base, AsDictMixin):
 
     __tablename__ = 'xroad_stats'
+    __table_args__ = (
+        UniqueConstraint('date', name='xroad_stats_date_key'),
+    )
 
     id = Column(types.UnicodeText, primary_key=True, default=make_uuid)
     date = Column(types.DateTime, nullable=False)
@@ -94,6 +250,9 @@ class XRoadStat(Base, AsDictMixin):
 class XRoadDistinctServiceStat(Base, AsDictMixin):
 
     __tablename__ = 'xroad_distinct_service_stats'
+    __table_args__ = (
+        UniqueConstraint('date', name='xroad_distinct_service_stats_date_key'),
+    )
 
     id = Column(types.UnicodeText, primary_key=True, default=make_uuid)
     date = Column(types.DateTime, nullable=False)
@@ -120,7 +279,7 @@ class XRoadServiceList(Base, AsDictMixin):
     __tablename__ = 'xroad_service_lists'
 
     id = Column(types.Integer, primary_key=True)
-    timestamp = Column(types.DateTime, nullable=False)
+    timestamp = Column(types.DateTime, nullable=False, index=True)
 
     @classmethod
     def create(cls, timestamp):
@@ -156,7 +315,7 @@ class XRoadServiceListSecurityServer(Base, AsDictMixin):
     __tablename__ = 'xroad_service_list_security_servers'
 
     id = Column(types.Integer, primary_key=True)
-    xroad_service_list_id = Column(types.Integer, ForeignKey("xroad_service_lists.id"), nullable=False)
+    xroad_service_list_id = Column(types.Integer, ForeignKey("xroad_service_lists.id"), nullable=False, index=True)
     instance = Column(types.Unicode, nullable=False)
     member_class = Column(types.Unicode, nullable=False)
     member_code = Column(types.Unicode, nullable=False)
@@ -181,7 +340,7 @@ class XRoadServiceListMember(Base, AsDictMixin):
     __tablename__ = 'xroad_service_list_members'
 
     id = Column(types.Integer, primary_key=True)
-    xroad_service_list_id = Column(types.Integer, ForeignKey("xroad_service_lists.id"), nullable=False)
+    xroad_service_list_id = Column(types.Integer, ForeignKey("xroad_service_lists.id"), nullable=False, index=True)
     created = Column(types.DateTime, nullable=False)
     instance = Column(types.Unicode, nullable=False)
     member_class = Column(types.Unicode, nullable=False)
@@ -218,7 +377,8 @@ class XRoadServiceListSubsystem(Base, AsDictMixin):
     __tablename__ = 'xroad_service_list_subsystems'
 
     id = Column(types.Integer, primary_key=True)
-    xroad_service_list_member_id = Column(types.Integer, ForeignKey("xroad_service_list_members.id"), nullable=False)
+    xroad_service_list_member_id = Column(types.Integer, ForeignKey("xroad_service_list_members.id"), nullable=False,
+                                          index=True)
     created = Column(types.DateTime, nullable=False)
     subsystem_code = Column(types.Unicode, nullable=False)
 
@@ -247,7 +407,8 @@ class XRoadServiceListService(Base, AsDictMixin):
     __tablename__ = 'xroad_service_list_services'
 
     id = Column(types.Integer, primary_key=True)
-    xroad_service_list_subsystem_id = Column(types.Integer, ForeignKey("xroad_service_list_subsystems.id"), nullable=False)
+    xroad_service_list_subsystem_id = Column(types.Integer, ForeignKey("xroad_service_list_subsystems.id"), nullable=False,
+                                             index=True)
     created = Column(types.DateTime, nullable=False)
     service_code = Column(types.Unicode, nullable=False)
     service_version = Column(types.Unicode, nullable=True)
@@ -269,6 +430,10 @@ class XRoadServiceListService(Base, AsDictMixin):
 class XRoadBatchResult(Base, AsDictMixin):
 
     __tablename__ = 'xroad_batch_results'
+    __table_args__ = (
+        # Latest result of each service
+        Index('xroad_batch_results_service_timestamp_idx', 'service', 'timestamp'),
+    )
 
     id = Column(types.UnicodeText, primary_key=True, default=make_uuid)
     service = Column(types.UnicodeText, nullable=False)
@@ -298,6 +463,45 @@ class XRoadBatchResult(Base, AsDictMixin):
         return results
 
 
+class XRoadHarvestFingerprint(Base, AsDictMixin):
+    __tablename__ = 'xroad_harvest_fingerprints'
+
+    guid = Column(types.UnicodeText, primary_key=True)
+    fingerprint = Column(types.UnicodeText, nullable=False)
+    updated = Column(types.DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    @classmethod
+    def get_active(cls):
+        '''Returns fingerprints by guid for harvested packages that still exist'''
+        return dict(model.Session.query(cls.guid, cls.fingerprint)
+                    .join(model.Package, model.Package.id == cls.guid)
+                    .filter(model.Package.state == 'active')
+                    .all())
+
+    @classmethod
+    def save(cls, guid, fingerprint):
+        model.Session.merge(cls(guid=guid, fingerprint=fingerprint))
+        model.repo.commit()
+
+
+class XRoadOrganizationCursor(Base, AsDictMixin):
+    '''Time of the last successful organization data check of an X-Road member'''
+    __tablename__ = 'xroad_organization_cursors'
+
+    member_code = Column(types.UnicodeText, primary_key=True)
+    checked = Column(types.DateTime, nullable=False)
+
+    @classmethod
+    def get_all(cls):
+        return dict(model.Session.query(cls.member_code, cls.checked).all())
+
+    @classmethod
+    def save_all(cls, checked_by_member_code):
+        for member_code, checked in checked_by_member_code.items():
+            model.Session.merge(cls(member_code=member_code, checked=checked))
+        model.repo.commit()
+
+
 class XRoadHeartbeat(Base, AsDictMixin):
     __tablename__ = 'xroad_heartbeat'
 
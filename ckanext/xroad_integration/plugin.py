@@ -6,7 +6,7 @@ from ckan.logic.auth.get import sysadmin
 import ckanext.xroad_integration.helpers as helpers
 from ckanext.xroad_integration.views import xroad
 from ckanext.xroad_integration.logic import action
-from ckanext.xroad_integration.auth import xroad_error_list
+from ckanext.xroad_integration.auth import xroad_error_list, xroad_error_stats
 
 import ckanext.xroad_integration.cli as cli
 
@@ -76,6 +76,7 @@ class Xroad_IntegrationPlugin(plugins.SingletonPlugin, DefaultTranslation):
             'update_xroad_organizations': action.update_xroad_organizations,
             'fetch_xroad_errors': action.fetch_xroad_errors,
             'xroad_error_list': action.xroad_error_list,
+            'xroad_error_stats': action.xroad_error_stats,
             'fetch_xroad_stats': action.fetch_xroad_stats,
             'fetch_distinct_service_stats': action.fetch_distinct_service_stats,
             'xroad_stats': action.xroad_stats,
@@ -95,6 +96,7 @@ class Xroad_IntegrationPlugin(plugins.SingletonPlugin, DefaultTranslation):
         return {
             'fetch_xroad_errors': sysadmin,
             'xroad_error_list': xroad_error_list,
+            'xroad_error_stats': xroad_error_stats,
             'update_xroad_organizations': sysadmin,
             'fetch_xroad_stats': sysadmin,
             'fetch_distinct_service_stats': sysadmin,
@@ -0,0 +1,49 @@
+"""Compares subsystem serialization codecs on the subsystems of catalog-response.json.
+
+Usage: python -m ckanext.xroad_integration.tests.benchmark_codecs [--rounds N]
+"""
+import argparse
+import json
+import os
+import timeit
+
+from ckanext.xroad_integration.harvesters.xroad_types import Member, Subsystem
+from ckanext.xroad_integration.harvesters.xroad_types_utils import CODECS
+
+CATALOG_RESPONSE = os.path.join(os.path.dirname(__file__), 'catalog-response.json')
+
+
+def load_subsystems(path=CATALOG_RESPONSE):
+    with open(path, 'r', encoding='utf-8') as f:
+        members = json.load(f)['ListMembersResponse']['memberList']['members']
+
+    return [subsystem for member in members for subsystem in Member.from_dict(member).subsystems]
+
+
+def benchmark(subsystems, rounds):
+    results = []
+    for tag in CODECS:
+        payloads = [subsystem.serialize(tag) for subsystem in subsystems]
+        encode = timeit.timeit(lambda: [subsystem.serialize(tag) for subsystem in subsystems], number=rounds)
+        decode = timeit.timeit(lambda: [Subsystem.deserialize(payload) for payload in payloads], number=rounds)
+        assert [Subsystem.deserialize(payload) for payload in payloads] == subsystems
+        results.append((tag, encode / rounds, decode / rounds, sum(len(payload) for payload in payloads)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    subsystems = load_subsystems()
+    print(f'{len(subsystems)} subsystems, {args.rounds} rounds')
+
+    row_format = '{:<15} {:>12} {:>12} {:>12}'
+    print(row_format.format('codec', 'encode (ms)', 'decode (ms)', 'size (B)'))
+    for tag, encode, decode, size in benchmark(subsystems, args.rounds):
+        print(row_format.format(tag, f'{encode * 1000:.2f}', f'{decode * 1000:.2f}', size))
+
+
+if __name__ == '__main__':
+    main()
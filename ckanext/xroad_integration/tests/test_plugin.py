@@ -1,17 +1,38 @@
 """Tests for plugin.py."""
+import base64
+import io
+import lzma
+import os
+import pickle
 from datetime import datetime
 
+import requests
 import six
-from ckanext.xroad_integration.model import XRoadServiceList, XRoadStat, XRoadDistinctServiceStat, XRoadError
+from ckanext.xroad_integration.model import XRoadServiceList, XRoadStat, XRoadDistinctServiceStat, XRoadError, \
+    XRoadOrganizationCursor, XRoadErrorRollup
 from ckan import model
+from ckan.lib import search
+from sqlalchemy import text
 from ckan.plugins import toolkit
 from ckan.tests.factories import Organization, User
 import pytest
 import json
-from ckanext.xroad_integration.harvesters.xroad_harvester import XRoadHarvesterPlugin
+from ckanext.xroad_integration.harvesters.xroad_harvester import XRoadHarvesterPlugin, ResourceIndex
+from ckanext.xroad_integration.harvesters.xroad_blob_store import BlobStore, BlobNotFound
+from ckanext.xroad_integration.harvesters.xroad_description_cache import ServiceDescriptionCache
+from ckanext.xroad_integration.harvesters.xroad_harvest_context import _run_contexts
+from ckanext.xroad_integration.harvesters.xroad_types import Subsystem, Service, ServiceDescription, iter_member_list
+from ckanext.xroad_integration.harvesters.xroad_types_utils import CODECS
+from ckanext.xroad_integration.xroad_http import create_session, TimeoutHTTPAdapter
+from ckanext.xroad_integration.xroad_utils import xroad_catalog_query
+from ckanext.xroad_integration.xroad_error_categories import (DEFAULT_RULES, ErrorCategories, ErrorCategoryRule,
+                                                              create_error_categories)
 from ckantoolkit.tests.helpers import call_action
+from ckanext.xroad_integration.logic.action import _organization_changed_fields, parse_xroad_catalog_datetime
+from ckanext.harvest.model import HarvestJob, HarvestObject, HarvestObjectExtra
 from ckanext.harvest.tests.lib import run_harvest
-from .fixtures import xroad_rest_service_url, xroad_rest_adapter_url
+from .fixtures import XROAD_REST_SERVICES, xroad_rest_service_url, xroad_rest_adapter_url
+from .benchmark_codecs import load_subsystems
 
 import logging
 log = logging.getLogger(__name__)
@@ -61,6 +82,84 @@ def test_base_twice(xroad_rest_adapter_mocks):
     run_harvest(url=url, harvester=harvester, config=config)
 
 
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_unchanged_subsystems_are_skipped(xroad_rest_adapter_mocks):
+    harvester = XRoadHarvesterPlugin()
+    url = xroad_rest_adapter_url('base')
+
+    results = run_harvest(url=url, harvester=harvester)
+    assert 'TEST.ORG.000003-3.EmptySubsystem' in results
+
+    results = run_harvest(url=url, harvester=harvester)
+    assert 'TEST.ORG.000003-3.EmptySubsystem' not in results
+
+    results = run_harvest(url=url, harvester=harvester, config=json.dumps({"force_all": True}))
+    assert 'TEST.ORG.000003-3.EmptySubsystem' in results
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_identical_resource_content_is_not_uploaded_again(xroad_rest_adapter_mocks):
+    harvester = XRoadHarvesterPlugin()
+    url = xroad_rest_adapter_url('base')
+    config = json.dumps({"force_all": True, "force_resource_update": True})
+
+    first_results = run_harvest(url=url, harvester=harvester, config=config)
+    results = run_harvest(url=url, harvester=harvester, config=config)
+
+    # SOAP, OpenAPI and REST service descriptions are unchanged
+    extras = {extra.key: extra.value for extra in model.Session.query(HarvestObjectExtra)
+              .filter(HarvestObjectExtra.harvest_object_id == results['TEST.ORG.000003-3.LargeSubsystem']['obj_id'])}
+    assert extras.get('skipped_resource_uploads') == '3'
+
+    # Resource metadata is kept when uploads are skipped
+    dataset = call_action('package_show', id='TEST.ORG.000003-3.LargeSubsystem')
+    resources = dataset['resources']
+    assert [resource.get('format') for resource in resources[2:]] == ['wsdl', 'openapi-json', 'rest']
+    assert all(resource.get('xroad_content_digest') for resource in resources[2:])
+
+    # Nothing changed, so the package is not written again
+    assert dataset['metadata_modified'] == first_results['TEST.ORG.000003-3.LargeSubsystem']['dataset']['metadata_modified']
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_description_cache_hits_are_recorded(xroad_rest_adapter_mocks):
+    harvester = XRoadHarvesterPlugin()
+    url = xroad_rest_adapter_url('base')
+    config = json.dumps({"force_all": True})
+
+    run_harvest(url=url, harvester=harvester, config=config)
+    results = run_harvest(url=url, harvester=harvester, config=config)
+
+    # SOAP and OpenAPI service descriptions are served from the cache
+    extras = {extra.key: extra.value for extra in model.Session.query(HarvestObjectExtra)
+              .filter(HarvestObjectExtra.harvest_object_id == results['TEST.ORG.000003-3.LargeSubsystem']['obj_id'])}
+    assert extras.get('description_cache_hits') == '2'
+    assert extras.get('description_cache_misses') == '0'
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_run_context_is_dropped_when_job_finishes(xroad_rest_adapter_mocks):
+    run_harvest(url=xroad_rest_adapter_url('base'), harvester=XRoadHarvesterPlugin())
+
+    job = model.Session.query(HarvestJob).one()
+    assert job.status == 'Finished'
+    assert job.id not in _run_contexts
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_harvest_does_not_commit_search_index(xroad_rest_adapter_mocks, monkeypatch):
+    commits = []
+    monkeypatch.setattr(search, 'commit', lambda: commits.append(True))
+
+    results = run_harvest(url=xroad_rest_adapter_url('base'), harvester=XRoadHarvesterPlugin(),
+                          config=json.dumps({"force_all": True}))
+
+    # Packages are indexed as they are written, without separate commits of the whole index
+    package_id = results['TEST.ORG.000003-3.LargeSubsystem']['dataset']['id']
+    assert call_action('package_search', fq='id:%s' % package_id)['count'] == 1
+    assert commits == []
+
+
 @pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
 @pytest.mark.ckan_config('ckan.plugins', 'apicatalog scheming_datasets scheming_organizations fluent harvest '
                                          'xroad_harvester xroad_integration')
@@ -121,10 +220,21 @@ def test_xroad_errors(xroad_rest_adapter_mocks, xroad_rest_mocks, migrate_db_for
 
     result = call_action('fetch_xroad_errors', start_date="2023-01-01", end_date="2023-01-05", limit=1)
     assert result['message'] == 'Fetched errors for xroad'
-    assert result['results']['message'] == '12 errors stored to database.'
 
+    # The mock lists the same errors for every organization and page, each of them is stored once
+    with open(os.path.join(os.path.dirname(__file__), XROAD_REST_SERVICES['get_list_errors_data']['content'])) as f:
+        listed_errors = json.load(f)['errorLogList']
+    natural_keys = {(parse_xroad_catalog_datetime(error['created']), error.get('code'), error.get('message') or '') +
+                    tuple(error.get(field) or '' for field in ('xroadInstance', 'memberClass', 'memberCode',
+                                                               'subsystemCode', 'serviceCode'))
+                    for error in listed_errors}
     db_entry_count = model.Session.query(XRoadError).count()
-    assert db_entry_count == 12
+    assert db_entry_count == len(natural_keys)
+    assert result['results']['message'] == '%d errors stored to database.' % len(natural_keys)
+
+    result = call_action('fetch_xroad_errors', start_date="2023-01-01", end_date="2023-01-05", limit=1)
+    assert result['results']['message'] == '0 errors stored to database.'
+    assert model.Session.query(XRoadError).count() == db_entry_count
 
     first = model.Session.query(XRoadError).first().as_dict()
     assert first['xroad_instance'] == 'FI-TEST'
@@ -135,6 +245,17 @@ def test_xroad_errors(xroad_rest_adapter_mocks, xroad_rest_mocks, migrate_db_for
                                'FI-TEST/GOV/1234567-8/some_member/listMethods): 500 Server Error'
 
 
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_xroad_errors_with_missing_fields_are_stored_once(migrate_db_for):
+    migrate_db_for('xroad_integration')
+
+    error = dict(message='Missing member', code=500, created=datetime(2023, 1, 17), xroad_instance=None,
+                 member_class=None, member_code=None, subsystem_code=None, service_code=None)
+    assert XRoadError.create_many([error]) == 1
+    assert XRoadError.create_many([dict(error)]) == 0
+    assert model.Session.query(XRoadError).one().member_code == ''
+
+
 @pytest.mark.freeze_time('2023-01-17')
 @pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
 def test_list_xroad_errors_for_organization(migrate_db_for):
@@ -167,6 +288,134 @@ def test_list_xroad_errors_for_organization(migrate_db_for):
     assert org_errors['previous'] == "2023-01-16"
 
 
+@pytest.mark.freeze_time('2023-01-17')
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_list_xroad_errors_pages(migrate_db_for):
+    migrate_db_for('xroad_integration')
+
+    for hour, message in enumerate(['Fetch of REST services failed', 'First', 'Second', 'Third']):
+        XRoadError.create(message=message, code=500, created=datetime(2023, 1, 17, hour), xroad_instance="FI-TEST",
+                          member_class="GOV", member_code="1234567-8", subsystem_code="some_error_member",
+                          service_code="some_service", service_version="", group_code="", server_code="",
+                          security_category_code="")
+
+    first = call_action('xroad_error_list', {}, category='other', limit=2)
+    assert first['counts'] == {'other': 3, 'rest_services_failed': 1}
+    assert first['total'] == 4
+    assert [e['message'] for e in first['list_errors']] == ['First', 'Second']
+    assert first['previous_page'] is None
+
+    second = call_action('xroad_error_list', {}, category='other', limit=2, after=first['next_page'])
+    assert [e['message'] for e in second['list_errors']] == ['Third']
+    assert second['next_page'] is None
+
+    previous = call_action('xroad_error_list', {}, category='other', limit=2, before=second['previous_page'])
+    assert [e['message'] for e in previous['list_errors']] == ['First', 'Second']
+    assert previous['previous_page'] is None
+    assert previous['next_page'] == first['next_page']
+
+    # Nothing follows a page before a token past the last error
+    last = call_action('xroad_error_list', {}, category='other', limit=2, before='2023-01-17T23:00:00_x')
+    assert [e['message'] for e in last['list_errors']] == ['Second', 'Third']
+    assert last['next_page'] is None
+
+    for limit in (0, -1, 1001, 'many'):
+        with pytest.raises(toolkit.ValidationError):
+            call_action('xroad_error_list', {}, limit=limit)
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_list_xroad_errors_covers_whole_day(migrate_db_for):
+    migrate_db_for('xroad_integration')
+
+    for message, created in [('Last', datetime(2023, 1, 17, 23, 59, 59, 500000)),
+                             ('Next day', datetime(2023, 1, 18))]:
+        XRoadError.create(message=message, code=500, created=created, xroad_instance="FI-TEST",
+                          member_class="GOV", member_code="1234567-8", subsystem_code="some_error_member",
+                          service_code="some_service", service_version="", group_code="", server_code="",
+                          security_category_code="")
+
+    listed = call_action('xroad_error_list', {}, date='2023-01-17')
+    assert [e['message'] for e in listed['list_errors']] == ['Last']
+    assert listed['total'] == 1
+
+
+@pytest.mark.freeze_time('2023-01-17')
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_xroad_error_stats(migrate_db_for):
+    migrate_db_for('xroad_integration')
+
+    for day, message in [(16, 'First'), (17, 'Fetch of REST services failed'), (17, 'Second'), (17, 'Second')]:
+        XRoadError.create(message=message, code=500, created=datetime(2023, 1, day), xroad_instance="FI-TEST",
+                          member_class="GOV", member_code="1234567-8", subsystem_code="some_error_member",
+                          service_code="some_service", service_version="", group_code="", server_code="",
+                          security_category_code="")
+
+    stats = call_action('xroad_error_stats', {}, start_date='2023-01-16', organization='FI-TEST.GOV.1234567-8')
+    assert stats['stats'] == [{'day': '2023-01-16', 'count': 1}, {'day': '2023-01-17', 'count': 2}]
+
+    by_category = call_action('xroad_error_stats', {}, start_date='2023-01-17', group_by='category')
+    assert by_category['stats'] == [{'category': 'other', 'count': 1}, {'category': 'rest_services_failed', 'count': 1}]
+
+    XRoadErrorRollup.rebuild()
+    assert call_action('xroad_error_stats', {}, start_date='2023-01-16')['stats'] == stats['stats']
+
+
+@pytest.mark.freeze_time('2023-01-17')
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_xroad_error_categories_are_stored(migrate_db_for):
+    migrate_db_for('xroad_integration')
+
+    errors = [dict(message=message, code=code, created=datetime(2023, 1, 17, hour), xroad_instance="FI-TEST",
+                   member_class="GOV", member_code="1234567-8", subsystem_code="some_error_member",
+                   service_code="some_service")
+              for hour, (message, code) in enumerate([('Fetch of REST services failed(url: https://somedomain)', 500),
+                                                      ('Access denied', 401),
+                                                      ('Internal error', 500)])]
+    assert XRoadError.create_many(errors) == 3
+
+    def stored_categories():
+        return {error.message: error.category for error in model.Session.query(XRoadError)}
+
+    assert stored_categories() == {'Fetch of REST services failed(url: https://somedomain)': 'rest_services_failed',
+                                   'Access denied': 'other',
+                                   'Internal error': 'other'}
+
+    listed = call_action('xroad_error_list', {}, category='rest_services_failed')
+    assert [e['message'] for e in listed['list_errors']] == ['Fetch of REST services failed(url: https://somedomain)']
+    listed = call_action('xroad_error_list', {}, category='other')
+    assert [e['message'] for e in listed['list_errors']] == ['Access denied', 'Internal error']
+
+    # Only errors whose category changes are updated
+    categories = ErrorCategories([ErrorCategoryRule('unauthorized', code=401)] + DEFAULT_RULES)
+    assert XRoadError.recategorize(categories) == 1
+    assert stored_categories() == {'Fetch of REST services failed(url: https://somedomain)': 'rest_services_failed',
+                                   'Access denied': 'unauthorized',
+                                   'Internal error': 'other'}
+    assert XRoadError.recategorize(categories) == 0
+
+
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
+def test_recategorize_errors_updates_rollup(migrate_db_for):
+    migrate_db_for('xroad_integration')
+
+    for hour, (message, code) in enumerate([('Access denied', 401), ('Access denied', 401), ('Other', 500)]):
+        XRoadError.create(message=message, code=code, created=datetime(2023, 1, 17, hour), xroad_instance="FI-TEST",
+                          member_class="GOV", member_code="1234567-8", subsystem_code="some_error_member",
+                          service_code="some_service", service_version="", group_code="", server_code="",
+                          security_category_code="")
+
+    def category_counts():
+        day = datetime(2023, 1, 17).date()
+        return {category: int(count) for category, count in XRoadErrorRollup.get_counts(day, day, ['category'])}
+
+    assert category_counts() == {'other': 3}
+
+    categories = ErrorCategories([ErrorCategoryRule('unauthorized', code=401)])
+    assert XRoadError.recategorize(categories) == 2
+    assert category_counts() == {'other': 1, 'unauthorized': 2}
+
+
 @pytest.mark.freeze_time('2023-01-17')
 @pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
 def test_view_xroad_errors_for_organization(migrate_db_for, app):
@@ -197,6 +446,40 @@ def test_view_xroad_errors_for_organization(migrate_db_for, app):
     assert 'Test message' in res
 
 
+@pytest.mark.usefixtures('with_plugins', 'clean_db')
+@pytest.mark.parametrize('query, index', [
+    ("SELECT * FROM xroad_errors WHERE xroad_instance = 'FI' AND member_class = 'GOV' AND member_code = '1' "
+     "AND created >= '2023-01-01' AND created <= '2023-01-02'", 'xroad_errors_member_created_idx'),
+    ("SELECT * FROM xroad_errors WHERE created >= '2023-01-01' AND created <= '2023-01-02'",
+     'xroad_errors_natural_key'),
+    ("SELECT * FROM xroad_service_lists WHERE timestamp >= '2023-01-01' AND timestamp <= '2023-01-02'",
+     'ix_xroad_service_lists_timestamp'),
+    ("SELECT * FROM xroad_service_list_security_servers WHERE xroad_service_list_id = 1",
+     'ix_xroad_service_list_security_servers_xroad_service_list_id'),
+    ("SELECT * FROM xroad_service_list_members WHERE xroad_service_list_id = 1",
+     'ix_xroad_service_list_members_xroad_service_list_id'),
+    ("SELECT * FROM xroad_service_list_subsystems WHERE xroad_service_list_member_id = 1",
+     'ix_xroad_service_list_subsystems_xroad_service_list_member_id'),
+    ("SELECT * FROM xroad_service_list_services WHERE xroad_service_list_subsystem_id = 1",
+     'ix_xroad_service_list_services_xroad_service_list_subsystem_id'),
+    ("SELECT * FROM xroad_stats WHERE date = '2023-01-01'", 'xroad_stats_date_key'),
+    ("SELECT * FROM xroad_distinct_service_stats WHERE date = '2023-01-01'", 'xroad_distinct_service_stats_date_key'),
+    ("SELECT service, max(timestamp) FROM xroad_batch_results GROUP BY service",
+     'xroad_batch_results_service_timestamp_idx'),
+    ("SELECT * FROM xroad_heartbeat WHERE timestamp >= '2023-01-01' AND timestamp <= '2023-01-02'",
+     'xroad_heartbeat_pkey'),
+])
+def test_xroad_table_indexes(migrate_db_for, query, index):
+    migrate_db_for('xroad_integration')
+
+    # Tables are empty, so sequential scans are disabled to see which indexes the planner can use
+    model.Session.execute(text('SET LOCAL enable_seqscan = off'))
+    plan = '\n'.join(row[0] for row in model.Session.execute(text('EXPLAIN ' + query)))
+    model.Session.rollback()
+
+    assert index in plan
+
+
 @pytest.mark.freeze_time('2022-01-02')
 @pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index')
 @pytest.mark.ckan_config('ckanext.xroad_integration.xroad_catalog_address', xroad_rest_service_url('getListOfServices'))
@@ -394,7 +677,10 @@ def test_xroad_get_organizations_organization_data(xroad_rest_adapter_mocks, xro
     context = {'model': model, 'session': model.Session, 'user': user, 'api_version': 3, 'ignore_auth': True}
     result = call_action('update_xroad_organizations', context=context)
     assert result['success'] is True
-    assert result['message'] == 'Updated 4 organizations'
+    assert result['message'] == 'Updated 4 organizations, 0 unchanged'
+    assert len(result['sources']) == 1
+    # First run has no cursors and updates all members fully, later runs only ask for changes since then
+    assert len(XRoadOrganizationCursor.get_all()) > 0
     updated_organization = call_action('organization_show', context=context, id='TEST.ORG.000000-0')
     assert updated_organization['title_translated']['fi'] == "Testiorganisaatio"
     assert updated_organization['title_translated']['sv'] == ""
@@ -425,7 +711,7 @@ def test_xroad_get_organizations_company_data(xroad_rest_adapter_mocks, xroad_re
     context = {'model': model, 'session': model.Session, 'user': user, 'api_version': 3, 'ignore_auth': True}
     result = call_action('update_xroad_organizations', context=context)
     assert result['success'] is True
-    assert result['message'] == 'Updated 4 organizations'
+    assert result['message'] == 'Updated 4 organizations, 0 unchanged'
     updated_organization = call_action('organization_show', context=context, id='TEST.ORG.000000-0')
     assert updated_organization['company_type']['fi'] == "Osakeyhtiö"
     assert updated_organization['company_type']['sv'] == "Aktiebolag"
@@ -448,12 +734,52 @@ def test_xroad_get_organizations_company_data_with_business_id_changes(xroad_res
     context = {'model': model, 'session': model.Session, 'user': user, 'api_version': 3, 'ignore_auth': True}
     result = call_action('update_xroad_organizations', context=context)
     assert result['success'] is True
-    assert result['message'] == 'Updated 4 organizations'
+    assert result['message'] == 'Updated 4 organizations, 0 unchanged'
     updated_organization = call_action('organization_show', context=context, id='TEST.ORG.000000-0')
 
     assert updated_organization['old_business_ids'] == ['124567-8', '7654321-8']
 
 
+@pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index', 'xroad_database_setup')
+@pytest.mark.ckan_config('ckanext.xroad_integration.xroad_catalog_address',
+                         xroad_rest_service_url('getOrganizationOrganizationData'))
+@pytest.mark.ckan_config('ckanext.xroad_integration.organization_fetch_concurrency', '1')
+def test_xroad_get_organizations_sequentially(xroad_rest_adapter_mocks, xroad_rest_mocks):
+    harvester = XRoadHarvesterPlugin()
+    run_harvest(url=xroad_rest_adapter_url('base'), harvester=harvester, config=json.dumps({"force_all": True}))
+    user = toolkit.get_action('get_site_user')({'model': model, 'ignore_auth': True}, {})['name']
+    context = {'model': model, 'session': model.Session, 'user': user, 'api_version': 3, 'ignore_auth': True}
+    result = call_action('update_xroad_organizations', context=context)
+    assert result['success'] is True
+    assert result['message'] == 'Updated 4 organizations, 0 unchanged'
+
+
+@pytest.mark.ckan_config('ckanext.xroad_integration.error_categories',
+                         '[{"category": "unauthorized", "code": 401}, {"category": "timeout", "prefix": "Read timed out"},'
+                         ' {"prefix": "Missing category"}]')
+def test_error_categories():
+    categories = create_error_categories()
+    assert categories.names == ['other', 'unauthorized', 'timeout', 'rest_services_failed']
+    assert categories.categorize('Access denied', 401) == 'unauthorized'
+    assert categories.categorize('Read timed out after 60s', 500) == 'timeout'
+    assert categories.categorize('Fetch of REST services failed(url: https://somedomain)', 500) == 'rest_services_failed'
+    assert categories.categorize('Missing category', 500) == 'other'
+
+
+def test_organization_changed_fields():
+    current = {'id': 'org', 'postal_address': 'Katu 14',
+               'title_translated': {'fi': 'Organisaatio', 'sv': '', 'en': ''},
+               'email_address_translated': {'fi': 'test@example.com', 'sv': 'test@example.com', 'en': 'test@example.com'}}
+    patch = {'id': 'org', 'postal_address': 'Katu 14',
+             'title_translated': {'fi': 'Organisaatio', 'sv': '', 'en': ''},
+             'email_address_translated': {'fi': 'test@example.com', 'sv': '', 'en': ''}}
+    assert _organization_changed_fields(current, patch) == []
+
+    patch['title_translated'] = {'fi': 'Organisaatio', 'sv': 'Organisation', 'en': ''}
+    patch['organization_guid'] = 'guid'
+    assert _organization_changed_fields(current, patch) == ['title_translated', 'organization_guid']
+
+
 @pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index', 'xroad_database_setup')
 @pytest.mark.ckan_config('ckanext.xroad_integration.xroad_catalog_address', xroad_rest_service_url('getOrganizationEmptyData'))
 def test_xroad_get_organizations_empty_data(xroad_rest_adapter_mocks, xroad_rest_mocks):
@@ -463,7 +789,7 @@ def test_xroad_get_organizations_empty_data(xroad_rest_adapter_mocks, xroad_rest
     context = {'model': model, 'session': model.Session, 'user': user, 'api_version': 3, 'ignore_auth': True}
     result = call_action('update_xroad_organizations', context=context)
     assert result['success'] is True
-    assert result['message'] == 'Updated 0 organizations'
+    assert result['message'] == 'Updated 0 organizations, 0 unchanged'
 
 
 @pytest.mark.usefixtures('with_plugins', 'clean_db', 'clean_index', 'xroad_database_setup')
@@ -479,3 +805,208 @@ def test_getrest(xroad_rest_adapter_mocks, xroad_rest_mocks):
     assert {'method': 'POST', 'path': '/PostSomething/v1'} in rest_service['rest_endpoints']['endpoints']
     assert {'method': 'GET', 'path': '/ComeGetSome/v1'} in rest_service['rest_endpoints']['endpoints']
     assert rest_service.get('format') == 'REST'
+
+
+@pytest.mark.parametrize('codec', list(CODECS))
+def test_subsystem_serialization_round_trip(codec):
+    subsystems = load_subsystems()
+    payloads = [subsystem.serialize(codec) for subsystem in subsystems]
+    assert all(payload.startswith(codec + ':') for payload in payloads)
+    assert [Subsystem.deserialize(payload) for payload in payloads] == subsystems
+
+
+def test_subsystem_deserialization_of_untagged_payload():
+    subsystem = load_subsystems()[0]
+    payload = base64.encodebytes(lzma.compress(pickle.dumps(subsystem))).decode('utf-8')
+    assert Subsystem.deserialize(payload) == subsystem
+
+
+def test_service_description_cache(tmp_path):
+    def description(external_id, changed):
+        return ServiceDescription(external_id=external_id, created=datetime(2020, 1, 1),
+                                  changed=changed, fetched=datetime(2020, 1, 1))
+
+    blob_store = BlobStore(str(tmp_path / 'blobs'))
+    cache = ServiceDescriptionCache(str(tmp_path / 'cache'), blob_store, 3, 1024)
+    first = description('1', datetime(2020, 1, 1))
+    second = description('2', datetime(2020, 1, 1))
+    third = description('3', datetime(2020, 1, 1))
+    a, b, c, d = blob_store.put('a'), blob_store.put('b'), blob_store.put('c'), blob_store.put('d' * 1023)
+
+    # Entries reference documents in the blob store instead of storing them again
+    cache.put('wsdl', first, a)
+    cache.put('wsdl', second, b)
+    cache.put('wsdl', third, c)
+    assert cache.get('wsdl', first) == a
+    assert cache.get('openapi', first) is None
+    assert cache.get('wsdl', description('1', datetime(2020, 1, 2))) is None
+
+    # A full cache is evicted below its limit, least recently used entries first
+    cache.put('openapi', first, c)
+    assert cache.get('wsdl', second) is None
+    assert cache.get('wsdl', third) is None
+    assert cache.get('wsdl', first) == a
+    assert cache.get('openapi', first) == c
+
+    # The total size of cached documents is limited as well
+    cache.put('openapi', second, d)
+    assert cache.get('wsdl', first) is None
+    assert cache.get('openapi', first) is None
+    assert cache.get('openapi', second) == d
+
+    # Entries of documents purged from the blob store are misses
+    assert blob_store.purge(-60) == 4
+    assert cache.get('openapi', second) is None
+
+
+@pytest.mark.ckan_config('ckanext.xroad_integration.http_connect_timeout', '2')
+@pytest.mark.ckan_config('ckanext.xroad_integration.http_endpoint_timeouts', 'getRest:5 GetWsdl:1,10 invalid')
+@pytest.mark.ckan_config('ckanext.xroad_integration.http_pool_maxsize', '20')
+def test_http_session_configuration():
+    session = create_session()
+
+    assert session.endpoint_timeouts['getRest'] == (2, 5)
+    assert session.endpoint_timeouts['GetWsdl'] == (1, 10)
+    assert 'invalid' not in session.endpoint_timeouts
+
+    for url in ('http://example.com', 'https://example.com'):
+        adapter = session.get_adapter(url)
+        assert isinstance(adapter, TimeoutHTTPAdapter)
+        assert adapter.timeout == (2, 60)
+        assert adapter._pool_maxsize == 20
+        assert 429 in adapter.max_retries.status_forcelist
+        assert 503 in adapter.max_retries.status_forcelist
+
+
+@pytest.mark.ckan_config('ckanext.xroad_integration.xroad_catalog_address', 'http://catalog.example.com')
+@pytest.mark.ckan_config('ckanext.xroad_integration.http_connect_timeout', '2')
+@pytest.mark.ckan_config('ckanext.xroad_integration.http_endpoint_timeouts', 'getRest:5')
+def test_endpoint_timeout_applied(monkeypatch):
+    applied = []
+
+    def send(adapter, request, timeout=None, **kwargs):
+        applied.append((request.url, timeout))
+        response = requests.Response()
+        response.status_code = 204
+        return response
+
+    session = create_session()
+    monkeypatch.setattr('ckanext.xroad_integration.xroad_utils.get_session', lambda: session)
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, 'send', send)
+
+    xroad_catalog_query('getRest/FI/GOV/1234567-8/subsystem/service')
+    xroad_catalog_query('listErrors')
+
+    assert applied == [('http://catalog.example.com/getRest/FI/GOV/1234567-8/subsystem/service', (2, 5)),
+                       ('http://catalog.example.com/listErrors', (2, 60))]
+
+
+def test_blob_store(tmp_path):
+    blob_store = BlobStore(str(tmp_path))
+
+    digest = blob_store.put('<definitions/>')
+    assert blob_store.put('<definitions/>') == digest
+    assert blob_store.put('{}') != digest
+    assert blob_store.get(digest) == '<definitions/>'
+
+    with pytest.raises(BlobNotFound):
+        blob_store.get('0' * 64)
+
+    # Uploads read the stored blob directly
+    with blob_store.open(digest) as f:
+        assert f.read() == b'<definitions/>'
+    with pytest.raises(BlobNotFound):
+        blob_store.open('0' * 64)
+
+    # Lazily opened blobs hold a file handle only while they are being read
+    with blob_store.open_lazy(digest, len(b'<definitions/>')) as f:
+        assert f.seek(0, os.SEEK_END) == len(b'<definitions/>')
+        f.seek(0)
+        assert f._file is None
+        assert f.read(4) == b'<def'
+        assert f._file is not None
+        assert f.read() == b'initions/>'
+        assert f._file is None
+    with pytest.raises(BlobNotFound):
+        blob_store.open_lazy('0' * 64, 0)
+
+    assert blob_store.purge(60) == 0
+    assert blob_store.purge(-60) == 2
+    with pytest.raises(BlobNotFound):
+        blob_store.get(digest)
+
+
+def test_iter_member_list_rejects_malformed_member():
+    member = {'xRoadInstance': 'TEST', 'memberClass': 'ORG', 'memberCode': '000001-1', 'name': 'Member',
+              'created': '2020-01-01T00:00:00', 'changed': '2020-01-01T00:00:00'}
+    stream = io.BytesIO(json.dumps({'memberList': {'member': [member]}}).encode('utf-8'))
+
+    with pytest.raises(ValueError, match='fetched'):
+        list(iter_member_list(stream))
+
+
+@pytest.mark.parametrize('content, valid', [
+    (b'<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"><wsdl:types/></wsdl:definitions>', True),
+    (b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+     b'<s:Body><s:Fault><faultcode>s:Server</faultcode></s:Fault></s:Body></s:Envelope>', False),
+    (b'<root><child/></root>', True),
+    (b'<!-- c --><root><a/><b/><c/></root>', True),
+    (b'<root><child></root>', False),
+    (b'', False),
+    (b'<a>' * 300 + b'</a>' * 300, False),
+])
+def test_is_valid_wsdl(content, valid):
+    assert XRoadHarvesterPlugin()._is_valid_wsdl(content) is valid
+
+
+def test_exclude_invalid_resources(monkeypatch):
+    harvester = XRoadHarvesterPlugin()
+    errors = []
+    monkeypatch.setattr(harvester, '_save_object_error', lambda message, obj, stage: errors.append(message))
+
+    previous = {'updated': {'id': 'updated', 'name': 'getData.v1'}}
+    package_dict = {'id': 'package', 'resources': [{'id': 'valid', 'name': 'listData.v1'},
+                                                   {'id': 'updated', 'name': 'getData.v2'},
+                                                   {'name': 'putData.v1'},
+                                                   {'name': 'deleteData.v1'}]}
+    error_dict = {'resources': [{}, {'url': ['Missing value']}, {'url': ['Missing value']}]}
+
+    assert harvester._exclude_invalid_resources(package_dict, previous, error_dict, HarvestObject(id='object'))
+    assert package_dict['resources'] == [{'id': 'valid', 'name': 'listData.v1'},
+                                         {'id': 'updated', 'name': 'getData.v1'},
+                                         {'name': 'deleteData.v1'}]
+    assert len(errors) == 2
+
+    # Package level errors are left to the write
+    assert not harvester._exclude_invalid_resources(package_dict, previous, {'name': ['Missing value']},
+                                                    HarvestObject(id='object'))
+
+
+def test_resource_index():
+    def service(code, version):
+        return Service(service_code=code, service_version=version, service_type='SOAP',
+                       created=datetime(2020, 1, 1), changed=datetime(2020, 1, 1), fetched=datetime(2020, 1, 1))
+
+    resources = [{'name': 'getData.v1', 'xroad_servicecode': 'getData', 'xroad_serviceversion': 'v1'},
+                 {'name': 'Renamed', 'xroad_servicecode': 'putData', 'xroad_serviceversion': 'v1'},
+                 {'name': 'getData.v1', 'xroad_servicecode': 'getData', 'xroad_serviceversion': 'v1'},
+                 {'name': 'listData.v1', 'xroad_servicecode': 'otherData', 'xroad_serviceversion': 'v1'},
+                 {'name': 'legacyData.v1'}]
+    index = ResourceIndex(resources)
+
+    assert index.duplicate_names() == ['getData.v1']
+    assert len(index.find(service('getData', 'v1'))) == 2
+    assert index.find(service('putData', 'v1')) == [resources[1]]
+    assert index.find(service('deleteData', None)) == []
+
+    # Only resources without X-Road keys are matched by name
+    assert index.find(service('listData', 'v1')) == []
+    assert index.find(service('legacyData', 'v1')) == [resources[4]]
+
+    index.update(resources[1], {'name': 'putData.v1'})
+    assert index.find(service('putData', 'v1')) == [resources[1]]
+    assert index.by_name.get('Renamed') == []
+
+    added = index.add({'name': 'deleteData', 'xroad_servicecode': 'deleteData', 'xroad_serviceversion': None})
+    assert index.find(service('deleteData', None)) == [added]
+    assert resources[-1] is added
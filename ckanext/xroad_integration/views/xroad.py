@@ -3,8 +3,10 @@ from flask import Blueprint
 import ckan.model as model
 import ckan.plugins as p
 from ckan import logic
-from ckan.plugins.toolkit import render, check_access, NotAuthorized, abort, _, g, get_action, ObjectNotFound, Invalid
+from ckan.plugins.toolkit import (render, check_access, NotAuthorized, abort, _, g, get_action, ObjectNotFound, Invalid,
+                                  ValidationError, url_for)
 from datetime import datetime
+from functools import partial
 from flask import request, make_response
 import logging
 import csv
@@ -25,9 +27,19 @@ def errors(date=None):
     except NotAuthorized:
         abort(403, _(u'Need to be system administrator to administer'))
 
-    error_list = get_action('xroad_error_list')({}, {"date": date})
+    try:
+        error_list = get_action('xroad_error_list')({}, _error_list_params(date=date))
+    except ValidationError as e:
+        abort(400, e.error_summary)
+
+    return render('admin/xroad_errors.html', extra_vars={
+        "error_list": error_list,
+        "errors_url": partial(url_for, 'xroad.errors', date=error_list['date'][:10])})
+
 
-    return render('admin/xroad_errors.html', extra_vars={"error_list": error_list})
+def _error_list_params(**params):
+    params.update({key: request.args.get(key) for key in ('category', 'after', 'before')})
+    return params
 
 
 xroad.add_url_rule(u'/errors/<date>', view_func=errors, strict_slashes=False)
@@ -44,13 +56,18 @@ def organization_errors(organization, date=None):
         abort(403, _(u'Need to be organization administrator to administer'))
 
     try:
-        error_list = get_action('xroad_error_list')({}, {"organization": organization, "date": date})
+        error_list = get_action('xroad_error_list')({}, _error_list_params(organization=organization, date=date))
     except ObjectNotFound:
         abort(404, _(u'Organization not found'))
     except Invalid as e:
         abort(404, e.error)
+    except ValidationError as e:
+        abort(400, e.error_summary)
 
-    return render('organization/xroad_errors.html', extra_vars={"error_list": error_list})
+    return render('organization/xroad_errors.html', extra_vars={
+        "error_list": error_list,
+        "errors_url": partial(url_for, 'xroad_organization.organization_errors', organization=organization,
+                              date=error_list['date'][:10])})
 
 
 xroad_organization.add_url_rule(u'/<organization>/errors/<date>', view_func=organization_errors, strict_slashes=False)
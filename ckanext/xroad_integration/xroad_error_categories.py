@@ -0,0 +1,92 @@
+import json
+import threading
+from logging import getLogger
+from typing import List, NamedTuple, Optional
+
+from ckan.plugins import toolkit
+
+log = getLogger(__name__)
+
+DEFAULT_CATEGORY = 'other'
+
+
+class ErrorCategoryRule(NamedTuple):
+    '''Assigns `category` to errors whose message starts with `prefix` and whose code is `code`
+
+    Matchers left as None match any error.
+    '''
+    category: str
+    prefix: Optional[str] = None
+    code: Optional[int] = None
+
+    def matches(self, message: str, code: int) -> bool:
+        return ((self.prefix is None or (message or '').startswith(self.prefix)) and
+                (self.code is None or code == self.code))
+
+
+DEFAULT_RULES = [
+    ErrorCategoryRule('rest_services_failed', prefix='Fetch of REST services failed'),
+]
+
+
+class ErrorCategories(object):
+    '''Rules used to categorize errors when they are stored, the first matching rule applies'''
+
+    def __init__(self, rules: List[ErrorCategoryRule]):
+        self.rules = rules
+
+    @property
+    def names(self) -> List[str]:
+        names = [DEFAULT_CATEGORY]
+        for rule in self.rules:
+            if rule.category not in names:
+                names.append(rule.category)
+        return names
+
+    def categorize(self, message: str, code: int) -> str:
+        return next((rule.category for rule in self.rules if rule.matches(message, code)), DEFAULT_CATEGORY)
+
+
+def _parse_rules(value: str) -> List[ErrorCategoryRule]:
+    '''Parses a JSON list of rules like `[{"category": "unauthorized", "prefix": "...", "code": 401}]`'''
+    if not value:
+        return []
+
+    try:
+        entries = json.loads(value)
+        if not isinstance(entries, list):
+            raise ValueError(value)
+    except ValueError:
+        log.warning('Ignoring invalid error categories %r', value)
+        return []
+
+    rules = []
+    for entry in entries:
+        try:
+            rule = ErrorCategoryRule(str(entry['category']), prefix=entry.get('prefix'),
+                                     code=int(entry['code']) if entry.get('code') is not None else None)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            log.warning('Ignoring invalid error category %r', entry)
+            continue
+        rules.append(rule)
+    return rules
+
+
+def create_error_categories() -> ErrorCategories:
+    '''Creates error categories from `ckanext.xroad_integration.error_categories`, checked before the defaults'''
+    configured = _parse_rules(toolkit.config.get('ckanext.xroad_integration.error_categories', ''))
+    return ErrorCategories(configured + DEFAULT_RULES)
+
+
+_error_categories: Optional[ErrorCategories] = None
+_error_categories_lock = threading.Lock()
+
+
+def get_error_categories() -> ErrorCategories:
+    '''Returns the error categories of this process'''
+    global _error_categories
+    if _error_categories is None:
+        with _error_categories_lock:
+            if _error_categories is None:
+                _error_categories = create_error_categories()
+    return _error_categories
@@ -0,0 +1,183 @@
+import threading
+import time
+from logging import getLogger
+from typing import Dict, Optional, Tuple
+
+import requests
+from ckan.plugins import toolkit
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from urllib3.util.retry import Retry
+
+log = getLogger(__name__)
+
+DEFAULT_CONNECT_TIMEOUT = 3  # seconds
+DEFAULT_READ_TIMEOUT = 60  # seconds
+DEFAULT_DEADLINE = 300  # seconds
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 1
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+MAX_RETRY_AFTER = 60  # seconds
+
+# ListMembers responses are large and produced slowly by the catalog
+DEFAULT_ENDPOINT_TIMEOUTS = {
+    'ListMembers': (DEFAULT_CONNECT_TIMEOUT, 300),
+}
+
+# Errors raised by the transport when a call could not be completed
+TRANSPORT_ERRORS = (ConnectionError, Timeout)
+
+TimeoutValue = Tuple[float, float]
+
+_call_state = threading.local()
+
+
+class DeadlineExceeded(ConnectionError, Timeout):
+    pass
+
+
+def _remaining_time() -> Optional[float]:
+    deadline = getattr(_call_state, 'deadline', None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class DeadlineRetry(Retry):
+    '''Retries on connection errors, 429 and 503 responses while honoring Retry-After
+
+    Waits are capped by the deadline of the current call and no further attempts are made once it has passed.
+    '''
+
+    def increment(self, *args, **kwargs):
+        remaining = _remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded('Deadline exceeded before the request could be retried')
+        return super().increment(*args, **kwargs)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return self._cap(min(retry_after, MAX_RETRY_AFTER))
+
+    def get_backoff_time(self):
+        return self._cap(super().get_backoff_time())
+
+    @staticmethod
+    def _cap(seconds: float) -> float:
+        remaining = _remaining_time()
+        return seconds if remaining is None else max(0, min(seconds, remaining))
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    '''Applies connect and read timeouts to every request, clamped by the deadline of the current call'''
+
+    def __init__(self, *args, timeout: TimeoutValue = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), **kwargs):
+        self.timeout = timeout
+        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        elif not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+
+        remaining = _remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded('Deadline exceeded before the request was sent', request=request)
+            timeout = tuple(remaining if t is None else min(t, remaining) for t in timeout)
+
+        return super(TimeoutHTTPAdapter, self).send(request, timeout=timeout, **kwargs)
+
+
+class XRoadSession(requests.Session):
+    '''Session used for all calls to X-Road services
+
+    Requests accept two extra keyword arguments: `endpoint` selects per-endpoint timeouts and
+    `deadline` limits the total time in seconds spent on the call including retries.
+    '''
+
+    def __init__(self, endpoint_timeouts: Dict[str, TimeoutValue], deadline: Optional[float]):
+        super(XRoadSession, self).__init__()
+        self.endpoint_timeouts = endpoint_timeouts
+        self.deadline = deadline
+
+    def request(self, method, url, *args, endpoint: Optional[str] = None, deadline: Optional[float] = None,
+                **kwargs):
+        if kwargs.get('timeout') is None and endpoint in self.endpoint_timeouts:
+            kwargs['timeout'] = self.endpoint_timeouts[endpoint]
+
+        if deadline is None:
+            deadline = self.deadline
+
+        previous_deadline = getattr(_call_state, 'deadline', None)
+        _call_state.deadline = time.monotonic() + deadline if deadline else None
+        try:
+            return super(XRoadSession, self).request(method, url, *args, **kwargs)
+        finally:
+            _call_state.deadline = previous_deadline
+
+
+def _parse_endpoint_timeouts(value: str, default_connect_timeout: float) -> Dict[str, TimeoutValue]:
+    '''Parses entries of form `endpoint:read_timeout` or `endpoint:connect_timeout,read_timeout`'''
+    timeouts = dict(DEFAULT_ENDPOINT_TIMEOUTS)
+    for entry in toolkit.aslist(value):
+        try:
+            endpoint, timeout = entry.split(':', 1)
+            values = [float(t) for t in timeout.split(',')]
+            if len(values) == 1:
+                timeouts[endpoint] = (default_connect_timeout, values[0])
+            elif len(values) == 2:
+                timeouts[endpoint] = (values[0], values[1])
+            else:
+                raise ValueError(entry)
+        except ValueError:
+            log.warning('Ignoring invalid endpoint timeout %r', entry)
+    return timeouts
+
+
+def create_session() -> XRoadSession:
+    '''Creates a session configured from `ckanext.xroad_integration.http_*` settings'''
+    config = toolkit.config
+    connect_timeout = float(config.get('ckanext.xroad_integration.http_connect_timeout', DEFAULT_CONNECT_TIMEOUT))
+    read_timeout = float(config.get('ckanext.xroad_integration.http_read_timeout', DEFAULT_READ_TIMEOUT))
+    deadline = float(config.get('ckanext.xroad_integration.http_deadline', DEFAULT_DEADLINE))
+    endpoint_timeouts = _parse_endpoint_timeouts(config.get('ckanext.xroad_integration.http_endpoint_timeouts', ''),
+                                                 connect_timeout)
+
+    retry_strategy = DeadlineRetry(
+        total=toolkit.asint(config.get('ckanext.xroad_integration.http_retries', DEFAULT_RETRIES)),
+        backoff_factor=float(config.get('ckanext.xroad_integration.http_backoff_factor', DEFAULT_BACKOFF_FACTOR)),
+        status_forcelist=(429, 503),
+        respect_retry_after_header=True,
+        # Return the last response once retries are exhausted, callers check the status
+        raise_on_status=False
+    )
+
+    adapter = TimeoutHTTPAdapter(
+        timeout=(connect_timeout, read_timeout),
+        max_retries=retry_strategy,
+        pool_connections=toolkit.asint(config.get('ckanext.xroad_integration.http_pool_connections',
+                                                  DEFAULT_POOL_CONNECTIONS)),
+        pool_maxsize=toolkit.asint(config.get('ckanext.xroad_integration.http_pool_maxsize', DEFAULT_POOL_MAXSIZE))
+    )
+
+    session = XRoadSession(endpoint_timeouts, deadline if deadline > 0 else None)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_session: Optional[XRoadSession] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> XRoadSession:
+    '''Returns the shared X-Road session of this process'''
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
@@ -2,12 +2,9 @@ import os
 from ckan.plugins import toolkit
 from typing import Dict, Any, List, Union
 from logging import getLogger
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 from simplejson.scanner import JSONDecodeError
 
-DEFAULT_TIMEOUT = 3  # seconds
+from ckanext.xroad_integration.xroad_http import get_session
 
 log = getLogger(__name__)
 
@@ -15,26 +12,6 @@ log = getLogger(__name__)
 Json = Union[Dict[str, "Json"], List["Json"], str, int, float, bool, None]
 
 
-# Add default timeout
-class TimeoutHTTPAdapter(HTTPAdapter):
-    def __init__(self, *args, **kwargs):
-        self.timeout = DEFAULT_TIMEOUT
-        if "timeout" in kwargs:
-            self.timeout = kwargs["timeout"]
-            del kwargs["timeout"]
-        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
-
-
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=1
-)
-
-adapter = TimeoutHTTPAdapter(max_retries=retry_strategy)
-http = requests.Session()
-http.mount("http://", adapter)
-
-
 class ContentFetchError(Exception):
     pass
 
@@ -78,7 +55,9 @@ def xroad_catalog_query(service, params: List = None,
     if xroad_client_certificate and os.path.isfile(xroad_client_certificate):
         certificate_args['cert'] = xroad_client_certificate
 
-    return http.get(url, params=queryparams, headers=headers, **certificate_args)
+    # Services such as getRest are called with a path, timeouts are configured for the first part
+    endpoint = service.split('/')[0]
+    return get_session().get(url, params=queryparams, headers=headers, endpoint=endpoint, **certificate_args)
 
 
 def xroad_catalog_query_json(service, params: List = None, queryparams: Dict[str, Any] = None,
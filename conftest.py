@@ -12,3 +12,4 @@ pytest_plugins = [
 def clean_db(reset_db, migrate_db_for):
     reset_db()
     migrate_db_for("harvest")
+    migrate_db_for("xroad_integration")